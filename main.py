@@ -2,19 +2,54 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import requests
+import hashlib
+import json
 import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from io import BytesIO
 from typing import List
+from zipfile import ZipFile
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
+from openpyxl.utils import get_column_letter
 from openpyxl.utils.dataframe import dataframe_to_rows
 
+from memory_governor import (
+    MEMORY_BUDGET, memory_admit, memory_register, memory_release, memory_report, memory_touch, memory_usage,
+    object_bytes, reserve_export,
+)
+from translations import TRANSLATIONS
+
+# Optional columnar / compressed export backends
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+try:
+    import zstandard  # noqa: F401  (used by pandas for compression="zstd")
+    HAVE_ZSTD = True
+except ImportError:
+    HAVE_ZSTD = False
+
+st.set_page_config(page_title="UDISE Data Generator Test", layout="wide")
+
 # Create tabs
-tab1, tab2 = st.tabs(["UDISE Data Generator", "District Split Export"])
+tab1, tab2, tab3, tab4 = st.tabs(["UDISE Data Generator", "District Split Export", "Year-over-Year Comparison", "Dashboard"])
 
 with tab1:
-    st.set_page_config(page_title="UDISE Data Generator Test", layout="wide")
-
     # -------------------------
     # Helpers
     # -------------------------
@@ -30,14 +65,20 @@ with tab1:
             return pd.Series([0] * len(df), index=df.index)
         return sum(series_list)
 
-    def to_excel_bytes_styled(df: pd.DataFrame, header_fill_color="0070C0") -> bytes:
-        """Write df to an excel file in-memory with header styling."""
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "udise_extract"
+    def write_excel_styled(df: pd.DataFrame, out, header_fill_color="0070C0", report=None):
+        """Write df with header styling to out (a path or binary file).
+
+        The workbook is write-only: rows are streamed out as they are appended, so every cell is styled as it
+        is written and column widths are sized from df up front. report(done, total, message) is called every
+        few thousand rows and once before saving, when given (background export jobs; it raises to cancel)."""
+        n_rows = len(df) + 1
+
+        def progress(done, message):
+            if report:
+                report(done, n_rows + 1, message)
 
-        for r in dataframe_to_rows(df, index=False, header=True):
-            ws.append(r)
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("udise_extract")
 
         thin = Side(border_style="thin", color="000000")
         border = Border(left=thin, right=thin, top=thin, bottom=thin)
@@ -45,189 +86,1094 @@ with tab1:
         header_fill = PatternFill(start_color=header_fill_color, end_color=header_fill_color, fill_type="solid")
         center = Alignment(horizontal="center", vertical="center", wrap_text=True)
 
-        # style header
-        for cell in ws[1]:
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.border = border
-            cell.alignment = center
-
-        # apply border to data cells
-        for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=1, max_col=ws.max_column):
-            for cell in row:
-                cell.border = border
-
-        # adjust widths
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                try:
-                    val = str(cell.value)
-                except:
-                    val = ""
-                if val:
-                    max_length = max(max_length, len(val))
-            ws.column_dimensions[column].width = min(50, (max_length + 2))
+        # adjust widths (must be set before the first row is written)
+        for j, col in enumerate(df.columns, start=1):
+            longest = df[col].astype(str).str.len().max() if len(df) else 0
+            longest = max(len(str(col)), 0 if pd.isna(longest) else int(longest))
+            ws.column_dimensions[get_column_letter(j)].width = min(50, longest + 2)
+
+        def cell(value, **style):
+            c = WriteOnlyCell(ws, value=value)
+            for name, val in style.items():
+                setattr(c, name, val)
+            return c
+
+        for i, r in enumerate(dataframe_to_rows(df, index=False, header=True)):
+            if i == 0:  # style header
+                ws.append([cell(v, font=header_font, fill=header_fill, border=border, alignment=center) for v in r])
+            else:
+                ws.append([cell(v, border=border) for v in r])
+            if i % 5000 == 0:
+                progress(i, "Writing rows")
 
+        progress(n_rows, "Saving workbook")  # last chance to cancel: wb.save cannot be interrupted
+        wb.save(out)
+
+    def to_excel_bytes_styled(df: pd.DataFrame, header_fill_color="0070C0", report=None) -> bytes:
+        """Write df to an excel file in-memory with header styling."""
         stream = BytesIO()
-        wb.save(stream)
-        stream.seek(0)
-        return stream.read()
-
-    # -------------------------
-    # Translations (basic)
-    # -------------------------
-    TRANSLATIONS = {
-        "en": {
-            "title": "UDISE Data Generator",
-            "upload": "Upload School Master List (Excel or CSV)",
-            "preview": "Preview Uploaded Data",
-            "udise_col": "Select UDISE Column",
-            "udise_input": "Enter one or more UDISE Codes (comma or newline separated)",
-            "select_columns": "Select Columns to Include in Output",
-            "generate": "Generate Output",
-            "filters": "Filters",
-            "create_calc": "Create Custom Fields (Optional)",
-            "calc_type": "Choose Calculation Type",
-            "sum": "Sum",
-            "diff": "Difference (A - B)",
-            "avg": "Average",
-            "custom": "Custom Formula (simple)",
-            "new_field": "Enter new field name (no spaces recommended)",
-            "add_field": "Add Calculated Field",
-            "preset_formulas": "Preset Formulas",
-            "download": "⬇ Download Excel Output",
-            "no_file": "Please upload a master list file to proceed.",
-            "no_udise": "Please enter at least one UDISE Code.",
-            "no_matches": "⚠ No matching UDISE codes found.",
-            "found_matches": "✔ Found {n} matching records",
-            "apply_filters": "Apply Filters",
-            "save_preset": "Save current computed fields as preset",
-            "preset_saved": "Preset saved in session.",
-            "preset_applied": "Applied preset {k}"
-        },
-        "ta": {
-            "title": "UDISE தரவு உருவாக்கி",
-            "upload": "பள்ளி மாஸ்டர் பட்டியலை (Excel அல்லது CSV) பதிவேற்றுங்கள்",
-            "preview": "பதிவேற்றப்பட்ட தரவின் முன்னோட்டம்",
-            "udise_col": "UDISE பத்து தேர்ந்தெடுக்கவும்",
-            "udise_input": "ஒரு அல்லது அதற்கு மேற்பட்ட UDISE குறியீடுகளை உள்ளிடுங்கள் (கமா அல்லது புதிய வரியில்)",
-            "select_columns": "ஏற்றுமதிக்கக் காணிக்கைகள் தேர்வு செய்க",
-            "generate": "வெளியீட்டை உருவாக்கு",
-            "filters": "வடிகட்டல்கள்",
-            "create_calc": "செயல்படுத்தப்பட்ட களங்களை உருவாக்கு (இருப்பினால்)",
-            "calc_type": "கணக்கீட்டு வகையை தேர்ந்தெடுக்கவும்",
-            "sum": "கூட்டல்",
-            "diff": "வித்தியாசம் (A - B)",
-            "avg": "சராசா",
-            "custom": "தனிப்பயன் சூத்திரம் (எளிது)",
-            "new_field": "புதிய களப் பெயரை உள்ளிடவும் (வெற்று இடங்கள் தவிர்க்கவும்)",
-            "add_field": "கணக்கீட்டுப் புலம் சேர்க்கவும்",
-            "preset_formulas": "முன்னிருப்பு சூத்திரங்கள்",
-            "download": "⬇ Excel பதிவிறக்கம்",
-            "no_file": "தொடர உங்கள் மாஸ்டர் பட்டியலை பதிவேற்றவும்.",
-            "no_udise": "அனைத்து குறைந்தது ஒரு UDISE குறியீட்டை உள்ளிடவும்.",
-            "no_matches": "⚠ பொருந்தக்கூடிய UDISE குறியீடுகள் இல்லை.",
-            "found_matches": "✔ {n} பொருந்தக்கூடிய பதிவுகள் காணப்பட்டன",
-            "apply_filters": "வடிகட்டல்கள் சமர்ப்பி",
-            "save_preset": "தற்போதைய கணக்கீட்டுச் புலங்களை மூலமாக சேமிக்கவும்",
-            "preset_saved": "முன்னிருப்பு செஷனில் சேமிக்கப்பட்டது.",
-            "preset_applied": "முன்னிருப்பு {k} பொருந்தியது"
-        }
-    }
+        write_excel_styled(df, stream, header_fill_color, report)
+        return stream.getvalue()
 
     # -------------------------
-    # Start UI
+    # Persistent presets & derived-column sidecars
     # -------------------------
-    st.title("🏫 UDISE Data Generator")
+    # UDISE_DATA_DIR: local store for saved presets (SQLite) and materialized field columns
+    DATA_DIR = os.environ.get("UDISE_DATA_DIR", ".udise_data")
+    PRESET_DB = os.path.join(DATA_DIR, "presets.sqlite3")
+
+    def preset_db() -> sqlite3.Connection:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        conn = sqlite3.connect(PRESET_DB)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS presets ("
+            " name TEXT PRIMARY KEY, fields TEXT NOT NULL, definitions TEXT NOT NULL, updated_at TEXT NOT NULL,"
+            " owner TEXT NOT NULL DEFAULT '')"
+        )
+        if "owner" not in [row[1] for row in conn.execute("PRAGMA table_info(presets)")]:  # stores created before owners
+            conn.execute("ALTER TABLE presets ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+        return conn
+
+    def preset_owner() -> str:
+        """Signed-in user's e-mail when authentication is configured, else "" (presets shared by everyone)."""
+        return st.user.get("email") or ""
+
+    def field_inputs(meta: dict) -> List[str]:
+        """Column names a field definition reads (custom formulas are compiled to find them)."""
+        if meta["type"] == "custom":
+            return sorted(compile(meta["definition"], "<formula>", "eval").co_names)
+        return list(meta["definition"])
+
+    def load_presets() -> dict:
+        """All saved presets: name -> {"fields": [...], "definitions": {field: meta}, "owner": str}."""
+        with closing(preset_db()) as conn:
+            rows = conn.execute("SELECT name, fields, definitions, owner FROM presets ORDER BY name").fetchall()
+        return {name: {"fields": json.loads(fields), "definitions": json.loads(defs), "owner": owner}
+                for name, fields, defs, owner in rows}
+
+    def save_preset(name: str, fields: List[str], definitions: dict, owner: str):
+        """Save (or replace) owner's preset; definitions are stored compiled, with their input columns.
+
+        Raises PermissionError when the name belongs to another owner."""
+        compiled = {f: {**meta, "inputs": field_inputs(meta)} for f, meta in definitions.items()}
+        with closing(preset_db()) as conn, conn:
+            row = conn.execute("SELECT owner FROM presets WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != owner:
+                raise PermissionError(f"Preset '{name}' belongs to another user.")
+            conn.execute(
+                "INSERT OR REPLACE INTO presets (name, fields, definitions, updated_at, owner) VALUES (?, ?, ?, ?, ?)",
+                (name, json.dumps(fields), json.dumps(compiled), time.strftime("%Y-%m-%d %H:%M:%S"), owner)
+            )
 
-    lang_choice = st.radio("Language / மொழி", ("English", "தமிழ்"), horizontal=True)
-    lang = "en" if lang_choice == "English" else "ta"
-    tr = TRANSLATIONS[lang]
+    def delete_preset(name: str, owner: str):
+        with closing(preset_db()) as conn, conn:
+            conn.execute("DELETE FROM presets WHERE name = ? AND owner = ?", (name, owner))
 
-    st.header(tr["title"])
+    SNAPSHOTS_KEPT = 8  # per-snapshot stores (sidecars, summaries) keep the most recently used snapshots
 
-    # Sidebar filters header
-    st.sidebar.header(tr["filters"])
+    def prune_snapshot_dirs(store: str, current: str):
+        """Mark DATA_DIR/<store>/<current> as used and remove all but the SNAPSHOTS_KEPT most recently used
+        snapshot directories of that store (by directory mtime; unfinished .tmp builds older than an hour too)."""
+        root = os.path.join(DATA_DIR, store)
+        if os.path.isdir(os.path.join(root, current)):
+            os.utime(os.path.join(root, current))
+        try:
+            entries = [(os.path.getmtime(os.path.join(root, d)), d) for d in os.listdir(root)]
+        except OSError:
+            return
+        snapshots = sorted((e for e in entries if not e[1].endswith(".tmp")), reverse=True)
+        stale = [d for _, d in snapshots[SNAPSHOTS_KEPT:] if d != current]
+        stale += [d for mtime, d in entries if d.endswith(".tmp") and mtime < time.time() - 3600]
+        for d in stale:
+            shutil.rmtree(os.path.join(root, d), ignore_errors=True)
+
+    def materialize_fields(snapshot_id: str, master: pd.DataFrame, field_defs: dict) -> dict:
+        """Field name -> values aligned with the master rows, for the fields in field_defs (in order).
+
+        Each field is stored as DATA_DIR/sidecars/<snapshot>/<definition hash>.npy. The hash covers the field
+        name, its definition and the hashes of the fields it reads, so an unchanged master + definition is
+        memory-mapped instead of recomputed, and a changed input invalidates everything built on it."""
+        sidecar_dir = os.path.join(DATA_DIR, "sidecars", snapshot_id)
+        new_snapshot = not os.path.isdir(sidecar_dir)
+        work = master.copy(deep=False)  # later fields may read earlier ones
+        hashes, out = {}, {}
+        for name, meta in field_defs.items():
+            key = {"name": name, "type": meta["type"], "definition": meta["definition"],
+                   "inputs": {c: hashes[c] for c in field_inputs(meta) if c in hashes}}
+            hashes[name] = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+            path = os.path.join(sidecar_dir, f"{hashes[name]}.npy")
+
+            if os.path.exists(path):
+                values = np.load(path, mmap_mode="r")
+            else:
+                values = np.asarray(compute_field(work, meta), dtype="float64")
+                os.makedirs(sidecar_dir, exist_ok=True)
+                tmp_path = f"{path}.{uuid.uuid4().hex[:6]}.tmp"
+                with open(tmp_path, "wb") as fh:
+                    np.save(fh, values)
+                os.replace(tmp_path, path)
+
+            work[name] = values
+            out[name] = values
+        if new_snapshot:
+            prune_snapshot_dirs("sidecars", snapshot_id)
+        elif os.path.isdir(sidecar_dir):
+            os.utime(sidecar_dir)  # most recently used
+        return out
 
-    # Session inits
-    if "formula_presets" not in st.session_state:
-        st.session_state["formula_presets"] = {}  # name -> list of fields
-    if "extra_fields" not in st.session_state:
-        st.session_state["extra_fields"] = []  # fields that have been created (preset or user-created) -> shown in dropdown
-    if "created_fields" not in st.session_state:
-        st.session_state["created_fields"] = {}  # name -> metadata for user-created calcs
-    if "selected_columns" not in st.session_state:
-        st.session_state["selected_columns"] = []  # persistent selection state
+    # -------------------------
+    # Export formats
+    # -------------------------
+    XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    EXPORT_FORMATS = {  # label -> (file extension, mime type)
+        "Excel (styled .xlsx)": (".xlsx", XLSX_MIME),
+        "CSV": (".csv", "text/csv"),
+        "CSV (gzip)": (".csv.gz", "application/gzip"),
+        "CSV (zstd)": (".csv.zst", "application/zstd"),
+        "Parquet": (".parquet", "application/vnd.apache.parquet"),
+        "Feather / Arrow IPC": (".feather", "application/vnd.apache.arrow.file"),
+    }
+
+    def available_export_formats() -> List[str]:
+        """Export formats whose optional backend (pyarrow / zstandard) is installed."""
+        formats = ["Excel (styled .xlsx)", "CSV", "CSV (gzip)"]
+        if HAVE_ZSTD:
+            formats.append("CSV (zstd)")
+        if HAVE_PYARROW:
+            formats += ["Parquet", "Feather / Arrow IPC"]
+        return formats
+
+    def arrow_ready(df: pd.DataFrame) -> pd.DataFrame:
+        """Give remaining object (mixed Python value) columns a string dtype so Arrow writes them column-wise."""
+        object_cols = [c for c in df.columns if df[c].dtype == object]
+        if object_cols:
+            df = df.astype({c: "string" for c in object_cols})
+        return df.reset_index(drop=True)
+
+    def export_bytes(df: pd.DataFrame, fmt: str, report=None) -> bytes:
+        """Serialize df in one of EXPORT_FORMATS. Columnar formats are written straight from the typed columns."""
+        if fmt == "Excel (styled .xlsx)":
+            return to_excel_bytes_styled(df, report=report)
+
+        buffer = BytesIO()
+        if fmt == "CSV":
+            return df.to_csv(index=False).encode("utf-8")
+        elif fmt == "CSV (gzip)":
+            df.to_csv(buffer, index=False, compression={"method": "gzip", "mtime": 0})
+        elif fmt == "CSV (zstd)":
+            df.to_csv(buffer, index=False, compression={"method": "zstd"})
+        elif fmt == "Parquet":
+            pq.write_table(pa.Table.from_pandas(arrow_ready(df), preserve_index=False), buffer, compression="zstd")
+        elif fmt == "Feather / Arrow IPC":
+            arrow_ready(df).to_feather(buffer, compression="zstd")
+        else:
+            raise ValueError(f"Unknown export format: {fmt}")
+        return buffer.getvalue()
 
     # -------------------------
-    # Load Master File (URL → Local → Upload)
+    # Memory budget: session results and spilled exports (the ledger itself lives in memory_governor.py)
     # -------------------------
+    SPILL_DIR = os.path.join(DATA_DIR, "spill")  # finished exports moved out of memory
 
-    import requests
-    from io import BytesIO
+    def session_uid() -> str:
+        return st.session_state.setdefault("memory_uid", uuid.uuid4().hex[:8])
 
-    st.subheader("Master Data Source")
+    class ResultSlot(dict):
+        """{"value": result} kept in session_state; a dict subclass so the ledger can hold it by weak reference."""
 
-    MASTER_URL = "https://d3ijhv7dn0xr3b.cloudfront.net/10684.csv"
+    def keep_result(name: str, value):
+        """Store a session result under name; it counts against the budget and may be evicted (read back as None).
 
-    df_master = None
-    source_used = None
+        The ledger entry goes away with the session."""
+        holder = ResultSlot(value=value)
+        st.session_state[name] = holder
+        memory_register(f"result:{session_uid()}:{name}", "result", object_bytes(value),
+                        evict=lambda ref=weakref.ref(holder): (ref() or {}).clear(), owner=holder)
 
-    # -------------------------------------------
-    # 1️⃣ Try loading from online master URL first
-    # -------------------------------------------
-    try:
-        st.write("Fetching default master file from online source...")
-        response = requests.get(MASTER_URL, timeout=10)
+    def get_result(name: str):
+        holder = st.session_state.get(name)
+        if holder is None:
+            return None
+        if not holder:
+            st.info("This result was released to stay within the server's memory budget — run it again to view it.")
+            return None
+        memory_touch(f"result:{session_uid()}:{name}")
+        return holder["value"]
+
+    # -------------------------
+    # Background export jobs
+    # -------------------------
+    EXPORT_MAX_WORKERS = 2        # process-wide export threads
+    MAX_ACTIVE_JOBS_PER_USER = 2  # queued + running jobs per browser session
+    BACKGROUND_EXPORT_ROWS = 20000  # tab1 Excel outputs larger than this are built as a job
+    EXPORT_RETENTION_S = 6 * 3600   # finished jobs and spilled files older than this are removed
+    EXCEL_WORK_FACTOR = 3           # Excel builds: openpyxl cell objects and the xlsx buffer on top of the input frames
+
+    class ExportCancelled(Exception):
+        """Raised inside a job's progress callback once the user cancels it."""
+
+    @st.cache_resource
+    def get_export_executor() -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(max_workers=EXPORT_MAX_WORKERS, thread_name_prefix="udise-export")
+
+    @st.cache_resource
+    def get_export_jobs() -> dict:
+        """Process-wide job registry (job_id -> job dict); survives script reruns."""
+        return {}
+
+    def session_export_jobs() -> list:
+        jobs = get_export_jobs()
+        return [jobs[j] for j in st.session_state.setdefault("export_jobs", []) if j in jobs]
+
+    def spill_path(job: dict) -> str:
+        os.makedirs(SPILL_DIR, exist_ok=True)
+        return os.path.join(SPILL_DIR, f"{job['id']}_{job['file_name']}")
+
+    def spill_export(job: dict, data: bytes = None):
+        """Move a finished export's bytes to SPILL_DIR; its download then reads the file."""
+        data = job["data"] if data is None else data
+        path = spill_path(job)
+        with open(path, "wb") as fh:
+            fh.write(data)
+        job["path"] = path
+        job["data"] = None
+
+    def read_spilled(path: str) -> bytes:
+        with open(path, "rb") as fh:
+            return fh.read()
+
+    def discard_export_job(job: dict):
+        """Forget a finished job: its memory entry, spilled file and registry slot."""
+        memory_release(f"export:{job['id']}")
+        if job["path"] and os.path.exists(job["path"]):
+            os.remove(job["path"])
+        get_export_jobs().pop(job["id"], None)
+
+    def prune_export_jobs():
+        """Discard finished jobs older than EXPORT_RETENTION_S and sweep stale files from SPILL_DIR."""
+        cutoff = time.time() - EXPORT_RETENTION_S
+        for job in list(get_export_jobs().values()):
+            if job["finished_at"] and job["finished_at"] < cutoff:
+                discard_export_job(job)
+        if os.path.isdir(SPILL_DIR):
+            for f in os.listdir(SPILL_DIR):
+                path = os.path.join(SPILL_DIR, f)
+                try:
+                    if os.path.getmtime(path) < cutoff:  # also files left behind by earlier server processes
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    def submit_export_job(label: str, file_name: str, mime: str, build_fn, *args, work_factor: float = 1.0):
+        """Queue build_fn(report, out, *args), which writes the file to the binary stream out, on the export executor.
+
+        The build waits for memory admission (see reserve_export) of work_factor times the size of args.
+        Admitted builds write to memory and the finished file is held within the budget (spilled to disk
+        when evicted); a build that does not fit runs alone and writes straight to its file in SPILL_DIR.
+        Returns the job id, or None when this session already has MAX_ACTIVE_JOBS_PER_USER jobs in flight."""
+        active = [j for j in session_export_jobs() if j["status"] in ("queued", "running")]
+        if len(active) >= MAX_ACTIVE_JOBS_PER_USER:
+            return None
+
+        job = {
+            "id": uuid.uuid4().hex[:8],
+            "label": label,
+            "file_name": file_name,
+            "mime": mime,
+            "status": "queued",
+            "progress": 0.0,
+            "message": "Waiting for a free export worker",
+            "cancel": threading.Event(),
+            "data": None,
+            "path": None,
+            "error": None,
+            "finished_at": None,
+        }
+        estimate = int(object_bytes(args) * work_factor)  # input frames scaled: a rough proxy for the working set
+
+        def report(done, total, message=""):
+            if job["cancel"].is_set():
+                raise ExportCancelled()
+            job["progress"] = min(1.0, done / max(1, total))
+            job["message"] = message
+
+        def run():
+            admission = reserve_export(job["id"], estimate)
+            while admission == "wait" and not job["cancel"].is_set():
+                job["message"] = "Waiting for memory (other exports in progress)"
+                time.sleep(1)
+                admission = reserve_export(job["id"], estimate)
+            if job["cancel"].is_set():
+                memory_release(f"export-build:{job['id']}")
+                job["status"] = "cancelled"
+                job["finished_at"] = time.time()
+                return
+            job["status"] = "running"
+            path = None
+            try:
+                if admission == "spill":  # over budget: never hold the file in memory
+                    path = spill_path(job)
+                    with open(path, "wb") as fh:
+                        build_fn(report, fh, *args)
+                    job["path"] = path
+                else:
+                    out = BytesIO()
+                    build_fn(report, out, *args)
+                    data = out.getvalue()
+                    del out
+                    if memory_admit(len(data)):
+                        job["data"] = data
+                        memory_register(f"export:{job['id']}", "export", len(data), evict=lambda: spill_export(job))
+                    else:
+                        spill_export(job, data)
+                job["progress"] = 1.0
+                job["status"] = "done"
+            except ExportCancelled:
+                job["status"] = "cancelled"
+            except Exception as e:
+                job["error"] = str(e)
+                job["status"] = "failed"
+            finally:
+                if path and job["status"] != "done" and os.path.exists(path):
+                    os.remove(path)  # partial file of a cancelled / failed build
+                memory_release(f"export-build:{job['id']}")
+                job["finished_at"] = time.time()
+
+        get_export_jobs()[job["id"]] = job
+        st.session_state.setdefault("export_jobs", []).append(job["id"])
+        get_export_executor().submit(run)
+        return job["id"]
+
+    def export_jobs_panel():
+        """Downloads list: progress / cancel for running jobs, download buttons for finished ones."""
+        prune_export_jobs()
+        jobs = session_export_jobs()
+        if not jobs:
+            st.caption("No exports yet.")
+            return
+
+        for job in reversed(jobs):
+            st.write(f"**{job['label']}** · `{job['id']}` · {job['status']}")
+            if job["status"] in ("queued", "running"):
+                st.progress(job["progress"], text=job["message"])
+                if st.button("Cancel", key=f"cancel_{job['id']}"):
+                    job["cancel"].set()
+            elif job["status"] == "done":
+                data = job["data"]
+                if data is None:  # spilled to disk: read only when clicked
+                    data = lambda path=job["path"]: read_spilled(path)
+                st.download_button(
+                    f"⬇ {job['file_name']}", data, file_name=job["file_name"],
+                    mime=job["mime"], key=f"dl_{job['id']}", on_click="ignore"
+                )
+            elif job["status"] == "failed":
+                st.error(f"Export failed: {job['error']}")
+
+            if job["status"] not in ("queued", "running") and st.button("Remove", key=f"remove_{job['id']}"):
+                discard_export_job(job)
+                st.session_state["export_jobs"].remove(job["id"])
+                st.rerun(scope="fragment")
 
-        if response.status_code == 200:
-            data = BytesIO(response.content)
+    # -------------------------
+    # Shared master (several Streamlit processes behind a proxy)
+    # -------------------------
+    # UDISE_SHARED_MASTER_DIR: directory for published snapshots (ideally on tmpfs, e.g. /dev/shm/udise_master)
+    # UDISE_SHARED_MASTER_ROLE: "publisher" loads the master and publishes it, "worker" (default) attaches
+    SHARED_MASTER_DIR = os.environ.get("UDISE_SHARED_MASTER_DIR")
+    SHARED_MASTER_ROLE = os.environ.get("UDISE_SHARED_MASTER_ROLE", "worker")
 
-            if MASTER_URL.lower().endswith(".csv"):
-                df_master = pd.read_csv(data, dtype=str)
-            elif MASTER_URL.lower().endswith(".xls"):
-                df_master = pd.read_excel(data, engine="xlrd", dtype=str)
+    def current_shared_version(root: str):
+        """Version name of the currently published master, or None if nothing is published yet."""
+        try:
+            with open(os.path.join(root, "CURRENT")) as fh:
+                return fh.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def publish_shared_master(frame: pd.DataFrame, root: str, source: str, snapshot_id: str = None,
+                              extras: dict = None) -> str:
+        """Write frame as a compact snapshot (numeric .npy arrays, dictionary-encoded text) and make it CURRENT.
+
+        The snapshot is written to a temp directory and renamed into place, then the CURRENT pointer is
+        swapped with os.replace, so attached workers never see a half-written version."""
+        os.makedirs(root, exist_ok=True)
+        version = time.strftime("v%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        tmp_dir = os.path.join(root, f".tmp-{version}")
+        os.makedirs(tmp_dir)
+
+        columns = []
+        for i, name in enumerate(frame.columns):
+            s = frame[name]
+            if pd.api.types.is_numeric_dtype(s):
+                np.save(os.path.join(tmp_dir, f"col{i}.npy"), s.to_numpy())
+                columns.append({"name": name, "kind": "numeric", "file": f"col{i}.npy"})
+            else:
+                cat = pd.Categorical(s)
+                np.save(os.path.join(tmp_dir, f"col{i}.codes.npy"), cat.codes)
+                columns.append({
+                    "name": name, "kind": "category", "file": f"col{i}.codes.npy",
+                    "categories": [str(c) for c in cat.categories],
+                })
+
+        # Small per-snapshot artifacts computed at load (e.g. the data quality report)
+        for name, extra in (extras or {}).items():
+            extra.to_pickle(os.path.join(tmp_dir, f"{name}.pkl"))
+
+        manifest = {
+            "version": version, "source": source, "snapshot_id": snapshot_id, "rows": len(frame),
+            "columns": columns, "extras": sorted(extras or {}),
+        }
+        with open(os.path.join(tmp_dir, "manifest.json"), "w") as fh:
+            json.dump(manifest, fh)
+        os.rename(tmp_dir, os.path.join(root, version))
+
+        pointer_tmp = os.path.join(root, f".CURRENT-{version}")
+        with open(pointer_tmp, "w") as fh:
+            fh.write(version)
+        os.replace(pointer_tmp, os.path.join(root, "CURRENT"))
+
+        # Keep the new and the previous version; older ones are no longer referenced by CURRENT
+        # (workers still holding them keep their mappings alive until they swap)
+        versions = sorted(d for d in os.listdir(root) if d.startswith("v"))
+        for old in versions[:-2]:
+            shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+        return version
+
+    @st.cache_resource(max_entries=2)
+    def attach_shared_master(root: str, version: str):
+        """Read-only, zero-copy view of a published master (memory-mapped arrays, categorical text columns).
+
+        Returns (frame, manifest, extras)."""
+        vdir = os.path.join(root, version)
+        with open(os.path.join(vdir, "manifest.json")) as fh:
+            manifest = json.load(fh)
+
+        data = {}
+        for col in manifest["columns"]:
+            arr = np.load(os.path.join(vdir, col["file"]), mmap_mode="r")
+            if col["kind"] == "numeric":
+                data[col["name"]] = arr
             else:
-                df_master = pd.read_excel(data, engine="openpyxl", dtype=str)
+                data[col["name"]] = pd.Categorical.from_codes(arr, categories=col["categories"])
+        extras = {name: pd.read_pickle(os.path.join(vdir, f"{name}.pkl")) for name in manifest.get("extras", [])}
+        return pd.DataFrame(data, copy=False), manifest, extras
+
+    @st.cache_resource
+    def get_publisher_state() -> dict:
+        return {}
+
+    def publish_if_changed(frame: pd.DataFrame, root: str, source: str, snapshot_id: str, extras: dict = None):
+        """Publisher side: publish frame unless this snapshot was already published by this process."""
+        state = get_publisher_state()
+        if state.get("snapshot_id") != snapshot_id or current_shared_version(root) != state.get("version"):
+            state["version"] = publish_shared_master(frame, root, source, snapshot_id, extras)
+            state["snapshot_id"] = snapshot_id
+        return state["version"]
+
+    # Column name candidates (sidebar filters / UDISE auto-detect)
+    filter_cols_candidates = {
+        "District": ["District", "district", "DISTRICT", "DISTRICT_NAME"],
+        "Block": ["Block", "block", "BLOCK", "BlockName"],
+        "Education District": ["Education District", "EducationDistrict", "EDU_DIST", "EDUCATION_DISTRICT"],
+        "School Type": ["School Type", "SchoolType", "Type", "SCHOOL_TYPE","School_Type"],
+        "Management": ["Management", "management", "MANAGEMENT"],
+        "Management Type": ["Management Type", "ManagementType",""],
+        "Category": ["Category", "category", "CATEGORY"],
+        "Category Type": ["Category Type", "CategoryType","Category_Type"]
+    }
 
-            source_used = f"Online URL: {MASTER_URL}"
-            st.success(f"✔ Loaded master file from URL")
+    udise_candidates = ["UDISE", "UDISE Code", "UDISE_Code", "udise", "udise_code", "UDISECODE"]
 
+    # --- DEFINE VALID DISTRICTS (Normalized to Uppercase for Case-Insensitive Match) ---
+    VALID_DISTRICTS_UPPER = [
+        "ARIYALUR", "CHENGALPATU", "CHENGALPATTU", "CHENNAI", "CHENNAI (EXT. GCC)", "COIMBATORE",
+        "CUDDALORE", "DHARMAPURI", "DINDIGUL", "ERODE", "KALLAKURICHI",
+        "KANCHEEPURAM", "KANNIYAKUMARI", "KARUR", "KRISHNAGIRI", "MADURAI",
+        "MAYILADUTHURAI", "NAGAPATTINAM", "NAMAKKAL", "PERAMBALUR", "PUDUKKOTTAI",
+        "RAMANATHAPURAM", "RANIPET", "SALEM", "SIVAGANGAI", "TENKASI",
+        "THANJAVUR", "THE NILGIRIS", "THENI", "THOOTHUKKUDI", "TIRUCHIRAPPALLI",
+        "TIRUNELVELI", "TIRUPATHUR", "TIRUPPUR", "TIRUVALLUR", "TIRUVANNAMALAI",
+        "TIRUVARUR", "VELLORE", "VILLUPURAM", "VIRUDHUNAGAR"
+    ]
+
+    # Known variant spellings -> canonical name, keyed by the normalized (upper-case, single-spaced) spelling.
+    # Keep this table up to date when new spellings show up under "Unknown district" in the quality report.
+    DISTRICT_ALIASES = {
+        "CHENGALPATU": "CHENGALPATTU",
+        "CHENGALPET": "CHENGALPATTU",
+        "KANCHIPURAM": "KANCHEEPURAM",
+        "KANYAKUMARI": "KANNIYAKUMARI",
+        "NILGIRIS": "THE NILGIRIS",
+        "PUDUKOTTAI": "PUDUKKOTTAI",
+        "SIVAGANGA": "SIVAGANGAI",
+        "THOOTHUKUDI": "THOOTHUKKUDI",
+        "TUTICORIN": "THOOTHUKKUDI",
+        "TIRUCHIRAPALLI": "TIRUCHIRAPPALLI",
+        "TRICHY": "TIRUCHIRAPPALLI",
+        "TIRUPUR": "TIRUPPUR",
+        "VILUPPURAM": "VILLUPURAM",
+    }
+    BLOCK_ALIASES = {}
+    CANONICAL_DISTRICTS = sorted(set(VALID_DISTRICTS_UPPER) - set(DISTRICT_ALIASES))
+
+    def canonicalize(series: pd.Series, aliases: dict) -> pd.Series:
+        """Map raw spellings to canonical categories, normalizing only the distinct values.
+
+        Each distinct spelling is upper-cased, whitespace-collapsed and looked up in aliases; the resulting
+        category code per raw category is then broadcast to the rows with one take()."""
+        raw = series.astype("category")
+        spellings = pd.Series(raw.cat.categories, dtype=str)
+        normalized = spellings.str.upper().str.replace(r"\s+", " ", regex=True).str.strip()
+        canonical = normalized.map(aliases).fillna(normalized)
+        canonical = canonical.where(canonical != "")  # blank names are missing, not a category
+
+        new_codes, new_categories = pd.factorize(canonical, sort=True)
+        # raw code -1 (missing) picks the appended -1
+        mapped = np.append(new_codes, -1)[raw.cat.codes.to_numpy()]
+        return pd.Series(pd.Categorical.from_codes(mapped, categories=new_categories),
+                         index=series.index, name=series.name)
+
+    @st.cache_resource  # no max_entries: evicted through the memory ledger
+    def canonical_dimensions(snapshot_id: str, _frame: pd.DataFrame) -> dict:
+        """Canonical District / Block columns of one master snapshot (column name -> categorical Series)."""
+        out = {}
+        for key, aliases in (("District", DISTRICT_ALIASES), ("Block", BLOCK_ALIASES)):
+            col = next((c for c in filter_cols_candidates[key] if c in _frame.columns), None)
+            if col:
+                out[col] = canonicalize(_frame[col], aliases)
+        memory_register(f"dims:{snapshot_id}", "index", object_bytes(out),
+                        evict=lambda: canonical_dimensions.clear(snapshot_id, None))
+        return out
+
+    # -------------------------
+    # Data quality (computed once per master snapshot)
+    # -------------------------
+    CLASS_COL_PATTERN = r"(?i)^Class\d+_(Boys|Girls|Transgen)$"
+    MAX_CLASS_COUNT = 1000  # per class & gender in one school; larger values are flagged as out of range
+    QUALITY_SAMPLE_SIZE = 5
+
+    def snapshot_hash(data: bytes) -> str:
+        """Short content hash identifying one master snapshot."""
+        return hashlib.sha1(data).hexdigest()[:16]
+
+    @st.cache_resource  # no max_entries: evicted through the memory ledger
+    def profile_master(snapshot_id: str, _raw: pd.DataFrame) -> dict:
+        """Single vectorized pass over the raw (text) master, cached per snapshot.
+
+        Returns {"summary": one row per check/column with count and sample values,
+        "exceptions": one row per offending cell, "numeric": class columns coerced to numbers (NaN -> 0)}."""
+        class_cols = [c for c in _raw.columns if re.match(CLASS_COL_PATTERN, c)]
+        udise_col = next((c for c in udise_candidates if c in _raw.columns), None)
+        district_col = next((c for c in filter_cols_candidates["District"] if c in _raw.columns), None)
+
+        ids = _raw[udise_col].str.strip() if udise_col else pd.Series(pd.NA, index=_raw.index, dtype="string")
+        districts = _raw[district_col] if district_col else pd.Series(pd.NA, index=_raw.index, dtype="string")
+        summary, exceptions = [], []
+
+        def add(check, column, mask, values):
+            """Record the rows selected by boolean array mask (values aligned with the frame rows)."""
+            if not mask.any():
+                return
+            bad_values = pd.Series(values[mask], dtype=object).fillna("").astype(str)  # blanks as "" (NaN stays float otherwise)
+            summary.append({"Check": check, "Column": column, "Count": int(mask.sum()),
+                            "Sample": ", ".join(bad_values.drop_duplicates().head(QUALITY_SAMPLE_SIZE))})
+            exceptions.append(pd.DataFrame({
+                "Row": _raw.index.to_numpy()[mask] + 2,  # spreadsheet row (header is row 1)
+                "UDISE": ids.to_numpy()[mask], "District": districts.to_numpy()[mask],
+                "Column": column, "Value": bad_values.to_numpy(), "Issue": check,
+            }))
+
+        # Class counts: coercion failures, negatives, out of range
+        raw_counts = _raw[class_cols]
+        numeric = raw_counts.apply(pd.to_numeric, errors="coerce")
+        checks = {
+            "Non-numeric count (read as 0)": (raw_counts.notna() & numeric.isna()).to_numpy(),
+            "Negative count": (numeric < 0).to_numpy(),
+            f"Count above {MAX_CLASS_COUNT}": (numeric > MAX_CLASS_COUNT).to_numpy(),
+        }
+        raw_values = raw_counts.to_numpy()
+        for check, masks in checks.items():
+            for j in np.flatnonzero(masks.any(axis=0)):
+                add(check, class_cols[j], masks[:, j], raw_values[:, j])
+
+        # Keys: missing / duplicate UDISE
+        if udise_col:
+            id_values = ids.to_numpy()
+            add("Missing UDISE", udise_col, ids.isna().to_numpy(), id_values)
+            add("Duplicate UDISE", udise_col, (ids.notna() & ids.duplicated(keep=False)).to_numpy(), id_values)
+
+        # Dimensions: district names that do not canonicalize to an approved district (distinct values only)
+        if district_col:
+            uniques = pd.Series(districts.dropna().unique())
+            unknown = uniques[~canonicalize(uniques, DISTRICT_ALIASES).isin(CANONICAL_DISTRICTS).to_numpy()]
+            add("Unknown district", district_col, districts.isin(unknown).to_numpy(), districts.to_numpy())
+            add("Missing district", district_col, districts.isna().to_numpy(), districts.to_numpy())
+
+        profile = {
+            "summary": pd.DataFrame(summary, columns=["Check", "Column", "Count", "Sample"]),
+            "exceptions": pd.concat(exceptions, ignore_index=True) if exceptions else pd.DataFrame(
+                columns=["Row", "UDISE", "District", "Column", "Value", "Issue"]),
+            "numeric": numeric.fillna(0),
+        }
+        memory_register(f"profile:{snapshot_id}", "index", object_bytes(profile),
+                        evict=lambda: profile_master.clear(snapshot_id, None))
+        return profile
+
+    def quality_report_ui(profile: dict, key: str):
+        """Expander with the per-check summary and a downloadable exceptions file."""
+        summary, exceptions = profile["summary"], profile["exceptions"]
+        if summary.empty:
+            with st.expander("🩺 Data quality: no issues found"):
+                st.write("No duplicate / missing UDISE codes, non-numeric, negative or out-of-range class counts, "
+                         "or unknown districts.")
+            return
+
+        with st.expander(f"🩺 Data quality: {len(exceptions):,} exceptions across {summary['Check'].nunique()} checks"):
+            totals = summary.groupby("Check", sort=False)["Count"].sum()
+            cols = st.columns(len(totals))
+            for col, (check, count) in zip(cols, totals.items()):
+                col.metric(check, f"{count:,}")
+            st.dataframe(summary, hide_index=True)
+            st.download_button(
+                "⬇ Download exceptions (CSV)", lambda: exceptions.to_csv(index=False).encode("utf-8"),
+                file_name="master_exceptions.csv", mime="text/csv", key=f"{key}_exceptions", on_click="ignore"
+            )
+
+    def offer_downloads(out_df: pd.DataFrame, file_base: str, label: str, key: str = None, formats: List[str] = None):
+        """Render a format picker + download button for a result frame.
+
+        The file is serialized only when the button is clicked, not on every rerun."""
+        formats = formats or available_export_formats()
+        c1, c2 = st.columns([2, 3])
+        fmt = c1.selectbox(f"{label} format", formats, key=f"{key}_fmt" if key else None)
+        ext, mime = EXPORT_FORMATS[fmt]
+        with c2:
+            st.write("")
+            st.download_button(
+                f"⬇ Download {label} ({fmt})",
+                lambda: export_bytes(out_df, fmt),
+                file_name=f"{file_base}{ext}",
+                mime=mime,
+                key=f"{key}_dl" if key else None,
+                on_click="ignore",
+            )
+
+    PAGE_SIZES = [25, 50, 100, 500]
+    COPY_CHUNK_ROWS = 5000
+    MAX_COPY_CHARS = 2_000_000  # larger TSV chunks are offered as a download instead of a text area
+
+    def result_viewer(result_df: pd.DataFrame, key: str, copy_label: str = "📋 Copy Output"):
+        """Paginated preview of a cached result.
+
+        TSV for copying is built only for the visible page or the requested chunk, so render
+        cost does not grow with the size of the result."""
+        n_rows = len(result_df)
+        c1, c2, c3 = st.columns([1, 1, 2])
+        page_size = c1.selectbox("Rows per page", PAGE_SIZES, index=1, key=f"{key}_page_size")
+        n_pages = max(1, -(-n_rows // page_size))
+        if st.session_state.get(f"{key}_page", 1) > n_pages:
+            st.session_state[f"{key}_page"] = n_pages
+        page = int(c2.number_input("Page", min_value=1, max_value=n_pages, step=1, key=f"{key}_page"))
+
+        start = (page - 1) * page_size
+        page_df = result_df.iloc[start:start + page_size]
+        c3.caption(f"Rows {start + 1:,}–{start + len(page_df):,} of {n_rows:,} · page {page} of {n_pages}")
+        st.dataframe(page_df)
+
+        st.markdown(f"### {copy_label}")
+        copy_mode = st.radio(
+            "Copy as TSV (Excel / Google Sheets friendly)",
+            ["Visible page", f"Chunk of {COPY_CHUNK_ROWS:,} rows", "Hide"],
+            horizontal=True,
+            key=f"{key}_copy_mode"
+        )
+        if copy_mode == "Hide":
+            return
+
+        if copy_mode == "Visible page":
+            part, part_name = page_df, f"page{page}"
         else:
-            st.warning(f"⚠ URL returned status code: {response.status_code}")
+            n_chunks = max(1, -(-n_rows // COPY_CHUNK_ROWS))
+            chunk = st.selectbox(
+                "Chunk",
+                list(range(1, n_chunks + 1)),
+                format_func=lambda i: f"{i}: rows {(i - 1) * COPY_CHUNK_ROWS + 1:,}–{min(i * COPY_CHUNK_ROWS, n_rows):,}",
+                key=f"{key}_chunk"
+            )
+            part, part_name = result_df.iloc[(chunk - 1) * COPY_CHUNK_ROWS:chunk * COPY_CHUNK_ROWS], f"chunk{chunk}"
 
-    except Exception as e:
-        st.warning(f"⚠ Could not load from online URL: {e}")
+        copy_text = part.to_csv(sep="\t", index=False)
+        if len(copy_text) > MAX_COPY_CHARS:
+            st.warning(f"This part is {len(copy_text) / 1e6:.1f} MB of text — too large to copy from the browser. Download it instead.")
+        else:
+            st.session_state[f"{key}_copy_text"] = copy_text
+            st.text_area("Copy (Ctrl + A → Ctrl + C):", key=f"{key}_copy_text", height=250)
+        st.download_button(
+            "⬇ Download this part (TSV)", lambda: part.to_csv(sep="\t", index=False), file_name=f"{key}_{part_name}.tsv",
+            mime="text/tab-separated-values", key=f"{key}_part_dl", on_click="ignore"
+        )
+
+    def read_master(data, name: str) -> pd.DataFrame:
+        """Read a master list (CSV / XLS / XLSX, chosen by file name) from a path, buffer or upload as text."""
+        lname = name.lower()
+        if lname.endswith(".csv"):
+            return pd.read_csv(data, dtype=str)
+        elif lname.endswith(".xls"):
+            return pd.read_excel(data, engine="xlrd", dtype=str)
+        return pd.read_excel(data, engine="openpyxl", dtype=str)
+
+    def udise_key(series: pd.Series) -> pd.Series:
+        """Compact Int64 join key for UDISE codes (whitespace / trailing '.0' removed, NA if not numeric)."""
+        s = series.astype(str).str.strip().str.replace(r"\.0$", "", regex=True)
+        return pd.to_numeric(s, errors="coerce").astype("Int64")
 
+    # -------------------------
+    # Derived fields & summary views (per snapshot)
+    # -------------------------
+    # Built-in preset fields as sum definitions, in dependency order (class totals before bands)
+    PRESET_FIELD_DEFS = {
+        f"Class{i}_Total": {"type": "sum", "definition": [f"Class{i}_Boys", f"Class{i}_Girls", f"Class{i}_Transgen"]}
+        for i in range(1, 13)
+    }
+    PRESET_FIELD_DEFS.update({
+        name: {"type": "sum", "definition": [f"Class{i}_Total" for i in classes]}
+        for name, classes in (("Enrollment_1_5", range(1, 6)), ("Enrollment_6_8", range(6, 9)),
+                              ("Enrollment_9_10", range(9, 11)), ("Enrollment_11_12", range(11, 13)),
+                              ("Total_Enrollment", range(1, 13)))
+    })
+
+    def compute_field(frame: pd.DataFrame, meta: dict) -> pd.Series:
+        """Evaluate one field definition ({"type": diff/sum/avg/custom, "definition": ...}) on frame."""
+        if meta["type"] == "diff":
+            a, b = meta["definition"]
+            return pd.to_numeric(frame.get(a, pd.Series(0, index=frame.index)), errors="coerce").fillna(0) - pd.to_numeric(frame.get(b, pd.Series(0, index=frame.index)), errors="coerce").fillna(0)
+        elif meta["type"] == "sum":
+            return safe_numeric_sum(frame, meta["definition"])
+        elif meta["type"] == "avg":
+            return safe_numeric_sum(frame, meta["definition"]) / max(1, len(meta["definition"]))
+        # custom: only the columns the compiled formula reads are coerced
+        try:
+            env = {c: pd.to_numeric(frame[c], errors="coerce").fillna(0) for c in field_inputs(meta) if c in frame.columns}
+            result = eval(meta["definition"], {"__builtins__": {}}, env)
+            return pd.Series(result, index=frame.index) if np.ndim(result) == 0 else result
+        except Exception:
+            return pd.Series(0, index=frame.index)
+
+    def registered_field_defs(extra_fields: List[str], created_fields: dict) -> dict:
+        """Definitions of every derived field to (re)build for output, in dependency order."""
+        class_total_names = [f"Class{i}_Total" for i in range(1,13)]
+        enroll_preset_names = ["Enrollment_1_5", "Enrollment_6_8", "Enrollment_9_10", "Enrollment_11_12", "Total_Enrollment"]
+        defs = {}
+        # 1) Class totals if registered (user clicked Ensure) or needed by the enrollment presets
+        if any(name in extra_fields for name in class_total_names + enroll_preset_names):
+            defs.update({name: PRESET_FIELD_DEFS[name] for name in class_total_names})
+        # 2) Enrollment presets if registered
+        if any(name in extra_fields for name in enroll_preset_names):
+            defs.update({name: PRESET_FIELD_DEFS[name] for name in enroll_preset_names})
+        # 3) User-created fields from metadata
+        defs.update(created_fields)
+        return defs
+
+    SUMMARY_LEVELS = {"District": ["District"], "District × Block": ["District", "Block"]}
+
+    def build_summary_views(snapshot_id: str, master: pd.DataFrame) -> dict:
+        """Standard summaries ("<level>: <view>" -> frame) by District and District × Block.
+
+        Class totals and enrollment bands come from the materialized field sidecars; every view is one
+        grouped reduction over categorical District / Block codes."""
+        dims = canonical_dimensions(snapshot_id, master)
+        keys = {}
+        for key in ("District", "Block"):
+            col = next((c for c in filter_cols_candidates[key] if c in dims), None)
+            if col:
+                keys[key] = dims[col].rename(key)
+
+        class_total_names = [f"Class{i}_Total" for i in range(1, 13)]
+        band_names = ["Enrollment_1_5", "Enrollment_6_8", "Enrollment_9_10", "Enrollment_11_12", "Total_Enrollment"]
+        fields = materialize_fields(snapshot_id, master, PRESET_FIELD_DEFS)
+        measures = pd.DataFrame({name: np.asarray(values) for name, values in fields.items()}, index=master.index)
+        genders = ["Boys", "Girls", "Transgen"]
+        for g in genders:
+            measures[g] = safe_numeric_sum(master, [f"Class{i}_{g}" for i in range(1, 13)])
+
+        views = {}
+        for level, names in SUMMARY_LEVELS.items():
+            if not all(n in keys for n in names):
+                continue
+            group_keys = [keys[n] for n in names]
+            grouped = measures.groupby(group_keys, observed=True, sort=True)
+            schools = grouped.size().rename("Schools")
+
+            views[f"{level}: Class totals"] = pd.concat([schools, grouped[class_total_names].sum()], axis=1).reset_index()
+            views[f"{level}: Enrollment bands"] = pd.concat([schools, grouped[band_names].sum()], axis=1).reset_index()
+
+            gender = grouped[genders].sum()
+            total = gender.sum(axis=1).replace(0, np.nan)
+            for g in genders:
+                gender[f"{g}_%"] = (gender[g] / total * 100).round(1)
+            views[f"{level}: Gender split"] = gender.reset_index()
+
+            for dim in ("Management", "Category"):
+                col = next((c for c in filter_cols_candidates[dim] if c and c in master.columns), None)
+                if col:
+                    counts = master[col].groupby(group_keys, observed=True, sort=True).value_counts().unstack(fill_value=0)
+                    counts.columns = [str(c) for c in counts.columns]
+                    views[f"{level}: Schools per {dim.lower()}"] = counts.reset_index()
+        return views
+
+    @st.cache_resource  # no max_entries: evicted through the memory ledger
+    def summary_views(snapshot_id: str, _master: pd.DataFrame) -> dict:
+        """Summary views of one snapshot, stored under DATA_DIR/summaries/<snapshot>/ (built on first use)."""
+        view_dir = os.path.join(DATA_DIR, "summaries", snapshot_id)
+        if os.path.exists(os.path.join(view_dir, "views.json")):
+            with open(os.path.join(view_dir, "views.json")) as fh:
+                names = json.load(fh)
+            views = {name: pd.read_pickle(os.path.join(view_dir, f"view{i}.pkl")) for i, name in enumerate(names)}
+        else:
+            views = build_summary_views(snapshot_id, _master)
+            tmp_dir = f"{view_dir}.{uuid.uuid4().hex[:6]}.tmp"
+            os.makedirs(tmp_dir)
+            for i, frame in enumerate(views.values()):
+                frame.to_pickle(os.path.join(tmp_dir, f"view{i}.pkl"))
+            with open(os.path.join(tmp_dir, "views.json"), "w") as fh:
+                json.dump(list(views), fh)
+            try:
+                os.rename(tmp_dir, view_dir)
+            except OSError:  # another process stored the same snapshot first
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        prune_snapshot_dirs("summaries", snapshot_id)
+        # evicted views are simply re-read from disk on next use
+        memory_register(f"summary:{snapshot_id}", "summary", object_bytes(views),
+                        evict=lambda: summary_views.clear(snapshot_id, None))
+        return views
 
-    # -------------------------------------------
-    # 2️⃣ Try local default master files (fallback)
-    # -------------------------------------------
-    if df_master is None:
-        default_files = ["master.xlsx", "master.xls", "master.csv"]
+    # -------------------------
+    # Warm startup (once per process, shared by every session)
+    # -------------------------
+    MASTER_URL = "https://d3ijhv7dn0xr3b.cloudfront.net/10684.csv"
+    DEFAULT_MASTER_FILES = ["master.xlsx", "master.xls", "master.csv"]
+    HEALTH_FILE = os.path.join(DATA_DIR, "health.json")  # readiness probe for the proxy / benchmarks
+    # Other masters users may pick (e.g. previous years for the YoY tab); never free-typed URLs or paths.
+    # UDISE_MASTER_SOURCES: extra master URLs (comma separated)
+    # UDISE_MASTER_FILES_DIR: directory whose .csv / .xls / .xlsx files are offered besides DEFAULT_MASTER_FILES
+    MASTER_SOURCES = [MASTER_URL] + [u.strip() for u in os.environ.get("UDISE_MASTER_SOURCES", "").split(",") if u.strip()]
+    MASTER_FILES_DIR = os.environ.get("UDISE_MASTER_FILES_DIR")
+
+    def server_master_files() -> List[str]:
+        """Master files on the server users may pick: DEFAULT_MASTER_FILES plus MASTER_FILES_DIR, if set."""
+        files = [f for f in DEFAULT_MASTER_FILES if os.path.isfile(f)]
+        if MASTER_FILES_DIR and os.path.isdir(MASTER_FILES_DIR):
+            files += sorted(
+                os.path.join(MASTER_FILES_DIR, f) for f in os.listdir(MASTER_FILES_DIR)
+                if f.lower().endswith((".csv", ".xls", ".xlsx")) and os.path.isfile(os.path.join(MASTER_FILES_DIR, f))
+            )
+        return files
+
+    def load_default_master(messages: list):
+        """Default master from the URL, else the first readable local master.* file.
+
+        Returns (frame, snapshot_id, source); status notes are appended to messages as (level, text)."""
+        try:
+            response = requests.get(MASTER_URL, timeout=10)
+            if response.status_code == 200:
+                messages.append(("success", "✔ Loaded master file from URL"))
+                return read_master(BytesIO(response.content), MASTER_URL), snapshot_hash(response.content), f"Online URL: {MASTER_URL}"
+            messages.append(("warning", f"⚠ URL returned status code: {response.status_code}"))
+        except Exception as e:
+            messages.append(("warning", f"⚠ Could not load from online URL: {e}"))
 
-        for f in default_files:
+        for f in DEFAULT_MASTER_FILES:
             if os.path.exists(f):
                 try:
-                    if f.endswith(".csv"):
-                        df_master = pd.read_csv(f, dtype=str)
-                    elif f.endswith(".xls"):
-                        df_master = pd.read_excel(f, engine="xlrd", dtype=str)
-                    else:
-                        df_master = pd.read_excel(f, engine="openpyxl", dtype=str)
+                    frame = read_master(f, f)
+                    with open(f, "rb") as fh:
+                        snap = snapshot_hash(fh.read())
+                    messages.append(("success", f"✔ Loaded default master file: {f}"))
+                    return frame, snap, f"Local file: {f}"
+                except Exception as e:
+                    messages.append(("warning", f"⚠ Found {f} but could not load it: {e}"))
+        return None, None, None
+
+    def prepare_master(snapshot_id: str, frame: pd.DataFrame) -> dict:
+        """Normalize column names and coerce class counts in place; returns the snapshot's quality profile."""
+        frame.columns = frame.columns.str.strip()
+        # --- COERCE class gender columns to numeric early ---
+        # The data quality pass does the coercion once per snapshot; reuse its numeric columns.
+        profile = profile_master(snapshot_id, frame)
+        numeric_counts = profile["numeric"]
+        if len(numeric_counts.columns):
+            frame[numeric_counts.columns] = numeric_counts
+        return profile
+
+    @st.cache_resource  # no max_entries: evicted through the memory ledger
+    def load_uploaded_master(snapshot_id: str, _upload):
+        """Read and prepare an uploaded master once per distinct file; returns (frame, quality profile)."""
+        frame = read_master(_upload, _upload.name)
+        profile = prepare_master(snapshot_id, frame)
+        # the cached result keeps the profile alive, so it is accounted and evicted together with the frame
+        memory_release(f"profile:{snapshot_id}")
+        memory_register(f"master:{snapshot_id}", "master", object_bytes((frame, profile)),
+                        evict=lambda: (load_uploaded_master.clear(snapshot_id, None),
+                                       profile_master.clear(snapshot_id, None)))
+        return frame, profile
+
+    @st.cache_resource(max_entries=4)
+    def master_indexes(snapshot_id: str, _master: pd.DataFrame) -> dict:
+        """UI lookups for one snapshot: sidebar filter options and which columns hold numeric values."""
+        dims = canonical_dimensions(snapshot_id, _master)
+        filter_options = {}
+        for key, candidates in filter_cols_candidates.items():
+            col = next((c for c in candidates if c in _master.columns), None)
+            if col:
+                values = dims.get(col, _master[col])
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    values = pd.Series(values.cat.remove_unused_categories().cat.categories)
+                filter_options[col] = sorted(values.dropna().astype(str).unique().tolist())
+        numeric = {c: bool(pd.to_numeric(_master[c], errors="coerce").notnull().any()) for c in _master.columns}
+        return {"filter_options": filter_options, "numeric_columns": numeric}
+
+    def write_health(status: dict):
+        """Atomically replace HEALTH_FILE with status (JSON)."""
+        os.makedirs(DATA_DIR, exist_ok=True)
+        tmp = f"{HEALTH_FILE}.{os.getpid()}.tmp"
+        with open(tmp, "w") as fh:
+            json.dump(status, fh, indent=2)
+        os.replace(tmp, HEALTH_FILE)
+
+    @st.cache_resource(max_entries=2)
+    def warm_start(shared_version: str = None) -> dict:
+        """Startup phase, run on the first script run of the process (and again per shared version).
+
+        Loads or attaches the default master, then builds its quality profile, canonical dimensions,
+        UI indexes, field sidecars and summary views so that sessions only do cached lookups."""
+        started = time.time()
+        state = {"master": None, "snapshot_id": None, "source": None, "quality": None,
+                 "shared_version": None, "messages": [], "timings": {}, "started_at": started}
+        write_health({"status": "starting", "pid": os.getpid(), "started_at": started})
+
+        def timed(step, fn, *args):
+            t = time.perf_counter()
+            result = fn(*args)
+            state["timings"][step] = round(time.perf_counter() - t, 3)
+            return result
+
+        messages = state["messages"]
+        frame = None
+        # Worker process: attach to the shared master if one is published
+        if shared_version:
+            try:
+                frame, manifest, extras = timed("load", attach_shared_master, SHARED_MASTER_DIR, shared_version)
+                state["snapshot_id"] = manifest.get("snapshot_id") or shared_version
+                state["shared_version"] = shared_version
+                if "quality_summary" in extras:
+                    state["quality"] = {"summary": extras["quality_summary"], "exceptions": extras["quality_exceptions"]}
+                state["source"] = f"Shared master: {shared_version}"
+                messages.append(("success", f"✔ Attached to shared master {shared_version}"))
+            except Exception as e:
+                messages.append(("warning", f"⚠ Could not attach shared master {shared_version}: {e}"))
+                frame = None
+        if frame is None:
+            frame, state["snapshot_id"], state["source"] = timed("load", load_default_master, messages)
+        snapshot_id = state["snapshot_id"]
+
+        if frame is not None:
+            # a shared master was coerced before it was published, so attached views are used as-is
+            if state["shared_version"] is None:
+                try:
+                    state["quality"] = timed("profile", prepare_master, snapshot_id, frame)
+                except Exception as e:  # serve the master unprofiled rather than not at all
+                    messages.append(("warning", f"⚠ Data quality pass failed, class counts are read as-is: {e}"))
+            else:
+                frame.columns = frame.columns.str.strip()
+            # Publisher process: share the loaded master with the worker processes
+            if SHARED_MASTER_DIR and SHARED_MASTER_ROLE == "publisher" and state["shared_version"] is None:
+                try:
+                    extras = {"quality_summary": state["quality"]["summary"],
+                              "quality_exceptions": state["quality"]["exceptions"]} if state["quality"] else {}
+                    published = timed("publish", publish_if_changed, frame, SHARED_MASTER_DIR, state["source"], snapshot_id, extras)
+                    messages.append(("caption", f"Published shared master: {published}"))
+                except Exception as e:
+                    messages.append(("warning", f"⚠ Could not publish shared master: {e}"))
+            timed("indexes", master_indexes, snapshot_id, frame)
+            try:
+                timed("fields", materialize_fields, snapshot_id, frame, PRESET_FIELD_DEFS)
+                timed("summaries", summary_views, snapshot_id, frame)
+            except Exception as e:  # District / class columns missing: built (or reported) on first use instead
+                messages.append(("caption", f"Summary precompute skipped: {e}"))
+            state["master"] = frame
+            # the startup master (and the profile state keeps with it) backs every session: counted, never evicted;
+            # a separate profile entry would free nothing when evicted, so it is folded in here
+            memory_release(f"profile:{snapshot_id}")
+            memory_register("master:startup", "master", object_bytes((frame, state["quality"])))
+
+        state["ready_at"] = time.time()
+        state["timings"]["total"] = round(state["ready_at"] - started, 3)
+        write_health({
+            "status": "ready" if frame is not None else "no_master",
+            "pid": os.getpid(),
+            "started_at": started,
+            "ready_at": state["ready_at"],
+            "snapshot_id": snapshot_id,
+            "source": state["source"],
+            "rows": 0 if frame is None else len(frame),
+            "timings": state["timings"],
+        })
+        return state
 
-                    source_used = f"Local file: {f}"
-                    st.success(f"✔ Loaded default master file: {f}")
-                    break
+    # -------------------------
+    # Start UI
+    # -------------------------
+    st.title("🏫 UDISE Data Generator")
 
-                except Exception as e:
-                    st.warning(f"⚠ Found {f} but could not load it: {e}")
+    lang_choice = st.radio("Language / மொழி", ("English", "தமிழ்"), horizontal=True)
+    lang = "en" if lang_choice == "English" else "ta"
+    tr = TRANSLATIONS[lang]
+
+    st.header(tr["title"])
+
+    # Sidebar filters header
+    st.sidebar.header(tr["filters"])
+
+    # Session inits
+    if "extra_fields" not in st.session_state:
+        st.session_state["extra_fields"] = []  # fields that have been created (preset or user-created) -> shown in dropdown
+    if "created_fields" not in st.session_state:
+        st.session_state["created_fields"] = {}  # name -> metadata for user-created calcs
+    if "selected_columns" not in st.session_state:
+        st.session_state["selected_columns"] = []  # persistent selection state
 
+    # -------------------------
+    # Load Master File (warm start: shared → URL → Local, then Upload)
+    # -------------------------
+    st.subheader("Master Data Source")
+
+    # The default master and everything derived from it are prepared once per process (see warm_start);
+    # a rerun only looks them up. Workers re-run the startup phase when a new shared version is published.
+    current_version = None
+    if SHARED_MASTER_DIR and SHARED_MASTER_ROLE == "worker":
+        current_version = current_shared_version(SHARED_MASTER_DIR)
+    startup = warm_start(current_version)
+    for level, message in startup["messages"]:
+        getattr(st, level)(message)
+    if startup["master"] is None:
+        warm_start.clear(current_version)  # no master (e.g. URL timeout): retry on the next run instead of caching it
+    if startup["master"] is not None:
+        steps = ", ".join(f"{step} {secs:.2f}s" for step, secs in startup["timings"].items() if step != "total")
+        st.caption(f"🟢 Ready · snapshot `{startup['snapshot_id']}` · {len(startup['master']):,} rows · "
+                   f"warm start {startup['timings']['total']:.2f}s ({steps})")
+
+    df_master = startup["master"]
+    snapshot_id = startup["snapshot_id"]
+    source_used = startup["source"]
+    quality_profile = startup["quality"]
+
+    if st.button("🔄 Reload master from source", key="reload_master",
+                 help="Fetch the default master again (for every session of this server process)."):
+        warm_start.clear()
+        st.rerun()
 
     # -------------------------------------------
-    # 3️⃣ Upload option always overrides previous
+    # Upload option always overrides previous
     # -------------------------------------------
     st.subheader("Optional: Upload master file to override default")
 
@@ -238,13 +1184,8 @@ with tab1:
 
     if uploaded_file is not None:
         try:
-            fname = uploaded_file.name.lower()
-            if fname.endswith(".csv"):
-                df_master = pd.read_csv(uploaded_file, dtype=str)
-            elif fname.endswith(".xls"):
-                df_master = pd.read_excel(uploaded_file, engine="xlrd", dtype=str)
-            else:
-                df_master = pd.read_excel(uploaded_file, engine="openpyxl", dtype=str)
+            snapshot_id = snapshot_hash(uploaded_file.getvalue())
+            df_master, quality_profile = load_uploaded_master(snapshot_id, uploaded_file)
 
             source_used = f"Uploaded file: {uploaded_file.name}"
             st.success(f"✔ Using uploaded master file: {uploaded_file.name}")
@@ -261,34 +1202,21 @@ with tab1:
         st.error("❌ No master data available. Please upload a file.")
         st.stop()
 
-    # Normalize columns
-    df_master.columns = df_master.columns.str.strip()
-
     # st.info(f"📌 Using master data from: **{source_used}**")
 
+    if quality_profile is not None:
+        quality_report_ui(quality_profile, "master_quality")
 
-    # --- COERCE class gender columns to numeric early ---
-    # This is the fix: convert ClassN_Boys/Girls/Transgen -> numeric with fillna(0)
-    import re
-    for col in df_master.columns:
-        if re.match(r"(?i)^Class\d+_(Boys|Girls|Transgen)$", col):  # case-insensitive match
-            df_master[col] = pd.to_numeric(df_master[col], errors="coerce").fillna(0)
+    # Working copy (shallow: new/changed columns are assigned, never written in place,
+    # so the master — possibly a read-only shared view — is left untouched)
+    df = df_master.copy(deep=False)
 
-    # Working copy
-    df = df_master.copy()
+    # Canonical District / Block spellings (computed once per snapshot): used to filter and group on,
+    # the raw values in df are what the outputs show
+    canonical_dims = canonical_dimensions(snapshot_id, df_master)
+    snapshot_index = master_indexes(snapshot_id, df_master)
 
     # Sidebar filters - detect available columns for each filter key
-    filter_cols_candidates = {
-        "District": ["District", "district", "DISTRICT", "DISTRICT_NAME"],
-        "Block": ["Block", "block", "BLOCK", "BlockName"],
-        "Education District": ["Education District", "EducationDistrict", "EDU_DIST", "EDUCATION_DISTRICT"],
-        "School Type": ["School Type", "SchoolType", "Type", "SCHOOL_TYPE","School_Type"],
-        "Management": ["Management", "management", "MANAGEMENT"],
-        "Management Type": ["Management Type", "ManagementType",""],
-        "Category": ["Category", "category", "CATEGORY"],
-        "Category Type": ["Category Type", "CategoryType","Category_Type"]
-    }
-
     def find_col(candidates):
         for c in candidates:
             if c in df.columns:
@@ -301,7 +1229,7 @@ with tab1:
         for key, candidates in filter_cols_candidates.items():
             col = find_col(candidates)
             if col:
-                options = sorted(df[col].dropna().astype(str).unique().tolist())
+                options = snapshot_index["filter_options"].get(col, [])
                 chosen = st.multiselect(f"{key}", options=options, key=f"filter_{key}")
                 if chosen:
                     selected_filters[col] = chosen
@@ -311,11 +1239,13 @@ with tab1:
     if selected_filters:
         mask = pd.Series([True] * len(df))
         for col, vals in selected_filters.items():
-            mask = mask & df[col].astype(str).isin(vals)
+            if col in canonical_dims:
+                mask = mask & canonical_dims[col].isin(vals)  # matched on canonical category codes
+            else:
+                mask = mask & df[col].astype(str).isin(vals)
         df = df[mask]
 
     # UDISE column auto-detect
-    udise_candidates = ["UDISE", "UDISE Code", "UDISE_Code", "udise", "udise_code", "UDISECODE"]
     udise_col = None
     for c in udise_candidates:
         if c in df.columns:
@@ -349,99 +1279,204 @@ with tab1:
     # ADVANCED PIVOT TABLE (PER-COLUMN AGGREGATION)
     # -------------------------------------------
 
-    st.markdown("---")
-    st.subheader("📊 Pivot Table with Per-Column Aggregation (Excel Style)")
-
-    # Numeric columns
-    numeric_cols = [
-        c for c in df.columns 
-        if pd.to_numeric(df[c], errors="coerce").notnull().any()
-    ]
-
-    # Categorical columns
-    categorical_cols = [
-        c for c in df.columns 
-        if c not in numeric_cols
-    ]
-
-    group_cols = st.multiselect(
-        "Select columns to GROUP BY:",
-        options=categorical_cols
-    )
-
-    value_cols = st.multiselect(
-        "Select value columns (to aggregate):",
-        options=numeric_cols
-    )
-
-    # Dictionary to store user-selected aggregation per column
-    col_aggs = {}
-
-    if value_cols:
-        st.write("### Select aggregation for each column:")
-        for col in value_cols:
-            col_aggs[col] = st.selectbox(
-                f"{col} → Aggregation",
-                ["sum", "mean", "count", "min", "max", "count_unique"],
-                key=f"agg_{col}"
-            )
-
-    do_group = st.button("Generate Pivot Table")
+    PIVOT_AGGS = ["sum", "mean", "median", "count", "min", "max", "count_unique", "p25", "p75", "p90"]
+
+    def dimension_keys(frame: pd.DataFrame, cols: List[str], dim_keys: dict = None) -> dict:
+        """Grouping keys for cols: the canonical Series from dim_keys (aligned to frame) where given, else frame[c]."""
+        dim_keys = dim_keys or {}
+        return {c: dim_keys[c].reindex(frame.index) if c in dim_keys else frame[c] for c in cols}
+
+    def pivot_engine(frame: pd.DataFrame, rows: List[str], value_aggs: dict, columns: str = None,
+                     subtotals: bool = False, grand_total: bool = False, dim_keys: dict = None) -> pd.DataFrame:
+        """Pivot frame by row (and optional column) dimensions with several aggregations per value column.
+
+        value_aggs maps value column -> list of PIVOT_AGGS ("pNN" = NN-th percentile). Dimensions are grouped
+        as categorical codes; subtotals (per leading row level) and the grand total are aggregated from the
+        rows themselves, so non-additive aggregations (mean, median, percentiles) stay correct.
+        dim_keys (column -> canonical Series) replaces a dimension's raw values as its group labels."""
+        values = frame[list(value_aggs)].apply(pd.to_numeric, errors="coerce").fillna(0)
+        dims = {c: key.astype("category") for c, key in dimension_keys(frame, rows + ([columns] if columns else []), dim_keys).items()}
+
+        def out_name(col, agg):
+            return col if len(value_aggs[col]) == 1 else f"{col}_{agg}"
+
+        def aggregate(level_rows: List[str]) -> pd.DataFrame:
+            keys = [dims[k] for k in level_rows + ([columns] if columns else [])]
+            if not level_rows:
+                keys.insert(0, pd.Series(0, index=frame.index, name="_all"))
+            grouped = values.groupby(keys, observed=True, sort=True)
+            parts = {}
+            for col, aggs in value_aggs.items():
+                for agg in aggs:
+                    if agg == "count_unique":
+                        parts[out_name(col, agg)] = grouped[col].nunique()
+                    elif agg.startswith("p") and agg[1:].isdigit():
+                        parts[out_name(col, agg)] = grouped[col].quantile(int(agg[1:]) / 100)
+                    else:
+                        parts[out_name(col, agg)] = getattr(grouped[col], agg)()
+            result = pd.DataFrame(parts)
+            if columns:
+                result = result.unstack(columns)
+                result.columns = [f"{name} | {col_val}" for name, col_val in result.columns]
+            result = result.reset_index()
+            return result.drop(columns="_all") if "_all" in result.columns else result
+
+        # depth = number of row levels a part is grouped by (len(rows) for detail rows)
+        levels = [(len(rows), rows)]
+        if subtotals:
+            levels += [(depth, rows[:depth]) for depth in range(len(rows) - 1, 0, -1)]
+        if grand_total:
+            levels.append((0, []))
+
+        pieces = []
+        for depth, level_rows in levels:
+            part = aggregate(level_rows)
+            sort_keys = {}
+            for i, r in enumerate(rows):
+                # detail rows sort before the subtotal of their group, grand total last
+                sort_keys[f"_flag{i}"] = 0 if i < depth else 1
+                sort_keys[f"_code{i}"] = part[r].cat.codes if i < depth else 0
+            part = part.assign(**sort_keys)
+            for i, r in enumerate(rows):
+                if i < depth:
+                    part[r] = part[r].astype(object)
+                else:
+                    part[r] = "Grand Total" if depth == 0 and i == 0 else ("Subtotal" if i == depth else "")
+            pieces.append(part)
+
+        order = [k for i in range(len(rows)) for k in (f"_flag{i}", f"_code{i}")]
+        out = pd.concat(pieces, ignore_index=True).sort_values(order, kind="stable")
+        return out.drop(columns=order).reset_index(drop=True)[rows + [c for c in pieces[0].columns if c not in rows and c not in order]]
+
+    def top_n_per_group(frame: pd.DataFrame, group_cols: List[str], value_col: str, n: int, largest: bool = True,
+                        dim_keys: dict = None) -> pd.DataFrame:
+        """Top-n rows of frame per group by value_col, with a Rank column (1 = best).
+
+        One stable sort on (group codes, value) partitions the rows; cumcount then ranks within each partition.
+        Groups are formed on dim_keys (canonical Series) where given; the rows keep their raw values."""
+        keys = {f"_g{i}": key.astype("category").cat.codes
+                for i, key in enumerate(dimension_keys(frame, group_cols, dim_keys).values())}
+        ordered = frame.assign(**keys, _v=pd.to_numeric(frame[value_col], errors="coerce")).sort_values(
+            list(keys) + ["_v"], ascending=[True] * len(keys) + [not largest], kind="stable", na_position="last"
+        )
+        rank = ordered.groupby(list(keys), sort=False).cumcount() + 1
+        keep = (rank <= n).to_numpy()
+        out = ordered[keep].drop(columns=list(keys) + ["_v"])
+        out.insert(0, "Rank", rank[keep].to_numpy())
+        return out[group_cols + ["Rank"] + [c for c in out.columns if c not in group_cols and c != "Rank"]].reset_index(drop=True)
+
+    def numeric_columns(frame: pd.DataFrame, known: dict = None) -> List[str]:
+        """Columns of frame holding any numeric value; columns already classified in known (name -> bool) are not rescanned."""
+        known = known or {}
+        return [
+            c for c in frame.columns
+            if (known[c] if c in known else pd.to_numeric(frame[c], errors="coerce").notnull().any())
+        ]
 
-    if do_group:
-        if not group_cols:
-            st.error("Please select at least one GROUP BY column.")
-        elif not value_cols:
-            st.error("Please select at least one VALUE column.")
-        else:
-            try:
-                # Prepare dict for pandas aggregation
-                agg_dict = {}
+    def pivot_ui(source_df: pd.DataFrame, key_prefix: str = "", file_base: str = "Pivot_Output", known_numeric: dict = None,
+                 dim_keys: dict = None):
+        """Group-by / per-column aggregation UI over source_df with preview and downloads."""
+        # Numeric columns
+        numeric_cols = numeric_columns(source_df, known_numeric)
 
-                for col in value_cols:
-                    func = col_aggs[col]
+        # Categorical columns
+        categorical_cols = [
+            c for c in source_df.columns
+            if c not in numeric_cols
+        ]
 
-                    if func == "count_unique":
-                        agg_dict[col] = pd.Series.nunique
-                    else:
-                        agg_dict[col] = func
+        group_cols = st.multiselect(
+            "Select columns to GROUP BY:",
+            options=categorical_cols,
+            key=f"{key_prefix}group_cols"
+        )
+
+        column_dim = st.selectbox(
+            "Column dimension (optional, cross-tab):",
+            options=[None] + [c for c in categorical_cols if c not in group_cols],
+            format_func=lambda c: "— none —" if c is None else c,
+            key=f"{key_prefix}column_dim"
+        )
+
+        value_cols = st.multiselect(
+            "Select value columns (to aggregate):",
+            options=numeric_cols,
+            key=f"{key_prefix}value_cols"
+        )
+
+        # Dictionary to store user-selected aggregations per column
+        col_aggs = {}
+
+        if value_cols:
+            st.write("### Select aggregations for each column:")
+            st.caption("p25 / p75 / p90 are percentiles (p50 = median).")
+            for col in value_cols:
+                col_aggs[col] = st.multiselect(
+                    f"{col} → Aggregations",
+                    PIVOT_AGGS,
+                    default=["sum"],
+                    key=f"{key_prefix}aggs_{col}"
+                )
 
-                    # Ensure numeric conversion
-                    df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+        c1, c2 = st.columns(2)
+        subtotals = c1.checkbox("Subtotals (per leading GROUP BY level)", key=f"{key_prefix}subtotals")
+        grand_total = c2.checkbox("Grand total", key=f"{key_prefix}grand_total")
 
-                # Apply groupby
-                pivot_df = df.groupby(group_cols).agg(agg_dict).reset_index()
+        do_group = st.button("Generate Pivot Table", key=f"{key_prefix}do_group")
 
-                st.success("Pivot generated successfully!")
-                st.dataframe(pivot_df.head(50))
+        if do_group:
+            if not group_cols:
+                st.error("Please select at least one GROUP BY column.")
+            elif not value_cols:
+                st.error("Please select at least one VALUE column.")
+            elif not all(col_aggs.values()):
+                st.error("Please select at least one aggregation for each VALUE column.")
+            else:
+                try:
+                    pivot_df = pivot_engine(source_df, group_cols, col_aggs, columns=column_dim, dim_keys=dim_keys,
+                                            subtotals=subtotals, grand_total=grand_total)
 
-                # Download buttons
-                excel_bytes = to_excel_bytes_styled(pivot_df)
-                csv_bytes = pivot_df.to_csv(index=False).encode("utf-8")
+                    keep_result(f"{key_prefix}pivot_result", pivot_df)
+                    st.success("Pivot generated successfully!")
 
-                st.download_button(
-                    "⬇ Download Pivot (Excel)",
-                    excel_bytes,
-                    file_name="Pivot_Output.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                )
+                except Exception as e:
+                    st.error(f"Error generating pivot: {e}")
+
+        pivot_df = get_result(f"{key_prefix}pivot_result")
+        if pivot_df is not None:
+            result_viewer(pivot_df, f"{key_prefix}pivot", copy_label="📋 Copy Pivot Output")
+
+            # Download buttons
+            offer_downloads(pivot_df, file_base, "Pivot", key=f"{key_prefix}pivot_dl")
+
+        # Top-N / rank within group
+        with st.expander("🏆 Top-N rows within each group"):
+            rank_col = st.selectbox("Rank by", options=numeric_cols, key=f"{key_prefix}topn_col")
+            c1, c2 = st.columns(2)
+            top_n = c1.number_input("N", min_value=1, value=10, step=1, key=f"{key_prefix}topn_n")
+            largest = c2.radio("Order", ["Largest first", "Smallest first"], horizontal=True,
+                               key=f"{key_prefix}topn_order") == "Largest first"
+
+            if st.button("Find Top-N", key=f"{key_prefix}do_topn"):
+                if not group_cols or not rank_col:
+                    st.error("Please select at least one GROUP BY column and a column to rank by.")
+                else:
+                    try:
+                        keep_result(f"{key_prefix}topn_result", top_n_per_group(
+                            source_df, group_cols, rank_col, int(top_n), largest, dim_keys=dim_keys
+                        ))
+                    except Exception as e:
+                        st.error(f"Error ranking rows: {e}")
 
-                st.download_button(
-                    "⬇ Download Pivot (CSV)",
-                    csv_bytes,
-                    file_name="Pivot_Output.csv",
-                    mime="text/csv",
-                )
+            topn_df = get_result(f"{key_prefix}topn_result")
+            if topn_df is not None:
+                result_viewer(topn_df, f"{key_prefix}topn", copy_label="📋 Copy Top-N Output")
+                offer_downloads(topn_df, f"{file_base}_TopN", "Top-N", key=f"{key_prefix}topn_dl")
 
-                copy_text = pivot_df.to_csv(sep="\t", index=False)
-                st.text_area(
-                    "📋 Copy Pivot Output:",
-                    copy_text,
-                    height=250
-                )
+    st.markdown("---")
+    st.subheader("📊 Pivot Table with Per-Column Aggregation (Excel Style)")
 
-            except Exception as e:
-                st.error(f"Error generating pivot: {e}")
+    pivot_ui(df, known_numeric=snapshot_index["numeric_columns"], dim_keys=canonical_dims)
 
     # Create helper to actually build preset fields on demand
     def build_class_totals(target_df):
@@ -470,6 +1505,57 @@ with tab1:
         target_df["Enrollment_11_12"] = safe_numeric_sum(target_df, [f"Class{i}_Total" for i in range(11,13)])
         target_df["Total_Enrollment"] = safe_numeric_sum(target_df, [f"Class{i}_Total" for i in range(1,13)])
 
+    COMPARE_METRICS = [f"Class{i}_Total" for i in range(1, 13)] + [
+        "Enrollment_1_5", "Enrollment_6_8", "Enrollment_9_10", "Enrollment_11_12", "Total_Enrollment"
+    ]
+
+    def comparison_frame(master: pd.DataFrame, udise_col: str, district_col=None):
+        """Narrow frame (_key, District, Class totals, enrollment bands) of one master, one row per UDISE.
+
+        Returns (frame, number of duplicate UDISE rows dropped)."""
+        member_cols = [c for c in master.columns if re.match(r"(?i)^Class\d+_(Boys|Girls|Transgen)$", c)]
+        frame = master[member_cols].copy()
+        build_class_totals(frame)
+        build_enrollment_presets(frame)
+
+        out = frame[COMPARE_METRICS].copy()
+        out.insert(0, "_key", udise_key(master[udise_col]))
+        if district_col:
+            out.insert(1, "District", canonicalize(master[district_col], DISTRICT_ALIASES).astype("string").fillna(""))
+        else:
+            out.insert(1, "District", "")
+
+        out = out[out["_key"].notna()]
+        dupes = int(out["_key"].duplicated().sum())
+        return out.drop_duplicates("_key"), dupes
+
+    def compare_masters(prev_frame: pd.DataFrame, curr_frame: pd.DataFrame):
+        """Hash-join two comparison frames on the UDISE key; return (per-school deltas, per-district deltas)."""
+        merged = prev_frame.merge(
+            curr_frame, on="_key", how="outer", suffixes=("_Prev", "_Curr"), indicator="Status", sort=True
+        )
+
+        schools = pd.DataFrame({"UDISE": merged["_key"].astype(str)})
+        schools["District"] = merged["District_Curr"].where(
+            merged["District_Curr"].fillna("") != "", merged["District_Prev"]
+        ).fillna("")
+        schools["Status"] = merged["Status"].cat.rename_categories(
+            {"left_only": "Only Previous", "right_only": "Only Current", "both": "Both"}
+        )
+        for m in COMPARE_METRICS:
+            prev_vals = merged[f"{m}_Prev"].fillna(0)
+            curr_vals = merged[f"{m}_Curr"].fillna(0)
+            schools[f"{m}_Prev"] = prev_vals
+            schools[f"{m}_Curr"] = curr_vals
+            schools[f"{m}_Delta"] = curr_vals - prev_vals
+
+        value_cols = [c for c in schools.columns if c.endswith(("_Prev", "_Curr", "_Delta"))]
+        districts = schools.groupby("District", sort=True)[value_cols].sum()
+        counts = pd.crosstab(schools["District"], schools["Status"]).add_prefix("Schools_")
+        districts = counts.join(districts).reset_index()
+
+        return schools, districts
+
     # -------------------------
     # Preset / Ensure Buttons - create fields only when user clicks
     # -------------------------
@@ -505,11 +1591,7 @@ with tab1:
     st.subheader(tr["create_calc"])
 
     # Determine numeric candidates
-    numeric_candidates = []
-    for c in df.columns:
-        tmp = pd.to_numeric(df[c], errors="coerce")
-        if not tmp.isnull().all():
-            numeric_candidates.append(c)
+    numeric_candidates = numeric_columns(df, snapshot_index["numeric_columns"])
 
     # ensure class totals in numeric candidates if already created
     for i in range(1,13):
@@ -570,27 +1652,51 @@ with tab1:
                 st.error(f"Error creating field: {e}")
 
     # -------------------------
-    # Preset saves / apply (session)
+    # Preset saves / apply (saved to the local preset store)
     # -------------------------
     st.markdown("---")
-    st.subheader("Presets (session)")
+    st.subheader("Presets (saved)")
 
     preset_name = st.text_input("Preset name (optional for save)")
 
     if st.button(tr["save_preset"]):
-        name = preset_name.strip() or f"preset_{len(st.session_state['formula_presets'])+1}"
-        # Save the list of extra_fields as this preset (session-only)
-        st.session_state["formula_presets"][name] = st.session_state["extra_fields"].copy()
-        st.success(tr["preset_saved"])
-
+        name = preset_name.strip() or f"preset_{len(load_presets())+1}"
+        # Save the list of extra_fields as this preset, with the definitions of user-created fields
+        fields = st.session_state["extra_fields"].copy()
+        definitions = {f: st.session_state["created_fields"][f] for f in fields if f in st.session_state["created_fields"]}
+        try:
+            save_preset(name, fields, definitions, preset_owner())
+            st.success(tr["preset_saved"])
+        except SyntaxError as e:
+            st.error(f"Could not save preset, a custom formula does not compile: {e}")
+        except PermissionError as e:
+            st.error(f"Could not save preset: {e} Choose another name.")
+
+    st.session_state["formula_presets"] = load_presets()
     if st.session_state["formula_presets"]:
-        st.write("Saved presets (session):")
+        st.write("Saved presets:")
         for k, v in st.session_state["formula_presets"].items():
-            if st.button(f"Apply preset: {k}"):
-                for f in v:
+            c1, c2 = st.columns([4, 1])
+            if c1.button(f"Apply preset: {k}", key=f"apply_preset_{k}"):
+                for f in v["fields"]:
                     if f not in st.session_state["extra_fields"]:
                         st.session_state["extra_fields"].append(f)
+                st.session_state["created_fields"].update(v["definitions"])
                 st.success(tr["preset_applied"].format(k=k))
+            # Only the owner may delete a preset, and only after confirming
+            if v["owner"] != preset_owner():
+                c2.caption(f"by {v['owner']}" if v["owner"] else "shared")
+            elif st.session_state.get("confirm_delete_preset") == k:
+                if c2.button("Confirm delete", key=f"confirm_delete_preset_{k}", type="primary"):
+                    delete_preset(k, preset_owner())
+                    st.session_state.pop("confirm_delete_preset")
+                    st.rerun()
+                if c2.button("Cancel", key=f"cancel_delete_preset_{k}"):
+                    st.session_state.pop("confirm_delete_preset")
+                    st.rerun()
+            elif c2.button("Delete", key=f"delete_preset_{k}"):
+                st.session_state["confirm_delete_preset"] = k
+                st.rerun()
 
     # -------------------------
     # Column selector (render after presets & calculated fields)
@@ -629,32 +1735,14 @@ with tab1:
         if df.empty:
             st.warning(tr["no_matches"])
         else:
-            # Recreate preset/class totals & user-created calculated fields on the current filtered df
-            # 1) If class totals were registered (user clicked Ensure), build them
-            class_total_names = [f"Class{i}_Total" for i in range(1,13)]
-            if any(name in st.session_state["extra_fields"] for name in class_total_names):
-                build_class_totals(df)
-
-            # 2) If enrollment presets were registered, (re)build them
-            enroll_preset_names = ["Enrollment_1_5", "Enrollment_6_8", "Enrollment_9_10", "Enrollment_11_12", "Total_Enrollment"]
-            if any(name in st.session_state["extra_fields"] for name in enroll_preset_names):
-                build_enrollment_presets(df)
-
-            # 3) Recreate user-created fields from metadata
-            for fname, meta in st.session_state["created_fields"].items():
-                if meta["type"] == "diff":
-                    a, b = meta["definition"]
-                    df[fname] = pd.to_numeric(df.get(a, pd.Series(0, index=df.index)), errors="coerce").fillna(0) - pd.to_numeric(df.get(b, pd.Series(0, index=df.index)), errors="coerce").fillna(0)
-                elif meta["type"] == "sum":
-                    df[fname] = safe_numeric_sum(df, meta["definition"])
-                elif meta["type"] == "avg":
-                    df[fname] = safe_numeric_sum(df, meta["definition"]) / max(1, len(meta["definition"]))
-                elif meta["type"] == "custom":
-                    env = {c: pd.to_numeric(df.get(c, 0), errors="coerce").fillna(0) for c in df.columns}
-                    try:
-                        df[fname] = eval(meta["definition"], {"__builtins__": {}}, env)
-                    except Exception:
-                        df[fname] = pd.Series(0, index=df.index)
+            # Recreate preset/class totals & user-created calculated fields on the current filtered df.
+            # Each field is materialized once per master snapshot (memory-mapped sidecar) and then
+            # sliced to the filtered rows, so an unchanged master never recomputes them.
+            field_defs = registered_field_defs(st.session_state["extra_fields"], st.session_state["created_fields"])
+            positions = df_master.index.get_indexer(df.index)
+            full_master = len(positions) == len(df_master) and (positions == np.arange(len(df_master))).all()
+            for fname, values in materialize_fields(snapshot_id, df_master, field_defs).items():
+                df[fname] = values if full_master else values[positions]
 
             # Validate selected columns
             valid_selected = [c for c in st.session_state["selected_columns"] if c in df.columns]
@@ -666,42 +1754,137 @@ with tab1:
             else:
                 out_df = df[valid_selected].copy()
 
-                st.success(tr["found_matches"].format(n=len(out_df)))
-                st.dataframe(out_df.head(50))
-
-                excel_bytes = to_excel_bytes_styled(out_df)
-                csv_bytes = out_df.to_csv(index=False).encode("utf-8")
-
                 filename_base = "UDISE_Filtered_Output"
                 if lang == "ta":
                     filename_base = "UDISE_வெளியீடு"
 
-                st.download_button(tr["download"], data=excel_bytes, file_name=filename_base + ".xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-                # -------------------------------------------
-                # Provide COPY OUTPUT option
-                # -------------------------------------------
-                st.markdown("### 📋 Copy Output")
+                background = len(out_df) > BACKGROUND_EXPORT_ROWS
+                if background:
+                    # Large selections: build the styled workbook off the script thread
+                    job_id = submit_export_job(
+                        f"{filename_base}.xlsx ({len(out_df)} rows)", filename_base + ".xlsx",
+                        XLSX_MIME, lambda report, out, frame: write_excel_styled(frame, out, report=report), out_df,
+                        work_factor=EXCEL_WORK_FACTOR
+                    )
+                    if job_id:
+                        st.info(f"Large output — Excel export queued as job `{job_id}`. It will appear under ⬇ Downloads in the sidebar.")
+                    else:
+                        st.warning(f"You already have {MAX_ACTIVE_JOBS_PER_USER} exports running. Wait for one to finish or cancel it.")
+
+                # Cache the result so paging / copying reruns don't recompute it
+                keep_result("generate_result", {"df": out_df, "file_base": filename_base, "background": background})
 
-                # Convert output DF to TSV (Excel/Google Sheets friendly)
-                copy_text = out_df.to_csv(sep="\t", index=False)
+    generate_result = get_result("generate_result")
+    if generate_result is not None:
+        out_df = generate_result["df"]
+        filename_base = generate_result["file_base"]
 
-                st.text_area(
-                "Copy the entire output (Ctrl + A → Ctrl + C):",
-                copy_text,
-                height=250
-                )
-                st.download_button("⬇ Download CSV", data=csv_bytes, file_name=filename_base + ".csv", mime="text/csv")
-                st.info("Excel has formatted headers (blue bold) and borders.")
+        st.success(tr["found_matches"].format(n=len(out_df)))
+        result_viewer(out_df, "generate")
+
+        # Files are serialized only when the download button is clicked
+        # (for large outputs the styled Excel is built by the background job instead)
+        formats = available_export_formats()
+        if generate_result["background"]:
+            formats.remove("Excel (styled .xlsx)")
+        offer_downloads(out_df, filename_base, "Output", key="generate_dl", formats=formats)
+        st.info("Excel has formatted headers (blue bold) and borders. Parquet / Feather keep column types for other tools.")
 
     # Footer
     st.markdown("---")
     st.caption("Built with ❤️ — if some class columns differ from ClassN_Boys/Girls/Transgen, give exact names and I'll adapt.")
 
 with tab2:
+    ID_COLUMNS = ['UDISE', 'District']
+
+    def convert_output_types(df: pd.DataFrame) -> pd.DataFrame:
+        """Convert fully numeric non-ID columns to numbers so OpenPyXL writes typed cells; text columns stay as-is."""
+        df = df.copy()
+        for col in df.columns:
+            if col not in ID_COLUMNS:
+                try:
+                    df[col] = pd.to_numeric(df[col])
+                except (ValueError, TypeError):
+                    pass
+        return df
+
+    def build_district_workbook(report, out, df_master: pd.DataFrame, df: pd.DataFrame):
+        """OPTION A: one workbook with the (column-filtered) master plus one sheet per district, written to out."""
+        df = convert_output_types(df)
+        groups = list(df.groupby("District", observed=True))
+
+        # We must use openpyxl directly for multiple sheets/tabs; write-only streams each sheet out as it is filled
+        wb = Workbook(write_only=True)
+
+        # ---- MASTER SHEET (full upload) ----
+        report(0, len(groups) + 1, "Writing MASTER_Original")
+        ws_master = wb.create_sheet(title="MASTER_Original")
+        for r in dataframe_to_rows(df_master, index=False, header=True):
+            ws_master.append(r)
+
+        # ---- DISTRICT SHEETS (based on df) ----
+        for i, (district, group) in enumerate(groups, start=1):
+            report(i, len(groups) + 1, f"Sheet {i}/{len(groups)}: {district}")
+            # Clean sheet name for excel constraints (max 31 chars, no invalid chars)
+            sheet_name = str(district)[:31].replace("/", "_").replace("*", "_")
+            ws = wb.create_sheet(title=sheet_name)
+
+            # openpyxl uses the updated numeric data types from the Pandas group
+            for r in dataframe_to_rows(group, index=False, header=True):
+                ws.append(r)
+
+        report(len(groups) + 1, len(groups) + 1, "Saving workbook")
+        wb.save(out)
+
+    def build_district_zip(report, out, df: pd.DataFrame, fmt: str = "Excel (styled .xlsx)"):
+        """OPTION B: ZIP file (written to out) containing one file per district (plain Excel or any other EXPORT_FORMATS entry)."""
+        df = convert_output_types(df)
+        groups = list(df.groupby("District", observed=True))
+
+        with ZipFile(out, 'w') as zf:
+            for i, (district, group) in enumerate(groups):
+                report(i, len(groups), f"File {i + 1}/{len(groups)}: {district}")
+
+                # Clean file name
+                safe_name = str(district)[:31].replace("/", "_").replace("*", "_")
+
+                if fmt != "Excel (styled .xlsx)":
+                    zf.writestr(f"{safe_name}{EXPORT_FORMATS[fmt][0]}", export_bytes(group, fmt))
+                    continue
+
+                wb = Workbook(write_only=True)
+                ws = wb.create_sheet(safe_name)
+
+                for r in dataframe_to_rows(group, index=False, header=True):
+                    ws.append(r)
+
+                # Write individual Excel file to buffer
+                excel_bytes = BytesIO()
+                wb.save(excel_bytes)
+
+                # Add buffer to zip file
+                zf.writestr(f"{safe_name}.xlsx", excel_bytes.getvalue())
+
+    def build_district_parquet_dataset(report, out, df: pd.DataFrame):
+        """OPTION C: one Parquet dataset partitioned by District (District=<name>/ folders), zipped into out."""
+        table = pa.Table.from_pandas(arrow_ready(convert_output_types(df)), preserve_index=False)
+        report(0, 2, "Writing partitioned Parquet dataset")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pq.write_to_dataset(table, os.path.join(tmp_dir, "district_dataset"), partition_cols=["District"],
+                                compression="zstd")
+            del table
+            report(1, 2, "Packing dataset")
+            with ZipFile(out, 'w') as zf:  # Parquet is already compressed, store as-is
+                for root, _, files in os.walk(tmp_dir):
+                    for name in files:
+                        path = os.path.join(root, name)
+                        zf.write(path, os.path.relpath(path, tmp_dir))
+
     # --- Global State Initialization (for Column Selection) ---
 # These variables help manage Streamlit's state for column selection
     df_master_loaded_temp = None
+    tab2_snapshot = None
     all_columns = []
     selected_columns_state = []
 
@@ -733,6 +1916,10 @@ with tab2:
             df_master_loaded_temp = pd.read_excel(uploaded_master, dtype=str)
             df_master_loaded_temp.columns = df_master_loaded_temp.columns.str.strip()
 
+            # Data quality report for this upload (cached per file content)
+            tab2_snapshot = snapshot_hash(uploaded_master.getvalue())
+            quality_report_ui(profile_master(tab2_snapshot, df_master_loaded_temp), "tab2_quality")
+
             # Column selection component
             selected_columns_state = st.multiselect(
                 "Select Columns to Export",
@@ -761,14 +1948,25 @@ with tab2:
     )
 
     # Choose output type
+    output_modes = [
+        "Single Excel → Each District as a Sheet",
+        "ZIP → One File per District"
+    ]
+    if HAVE_PYARROW:
+        output_modes.append("Parquet Dataset → Partitioned by District (ZIP)")
     output_mode = st.radio(
         "Choose Output Type",
-        [
-            "Single Excel → Each District as a Sheet",
-            "ZIP → One Excel File per District"
-        ],
+        output_modes,
         key="output_mode_tab2"
     )
+    district_file_format = "Excel (styled .xlsx)"
+    if output_mode.startswith("ZIP"):
+        district_file_format = st.selectbox(
+            "File format per district",
+            available_export_formats(),
+            format_func=lambda f: "Excel (.xlsx)" if f == "Excel (styled .xlsx)" else f,
+            key="district_format_tab2"
+        )
         
     if st.button("Generate Output", key="generate_btn_tab2"):
 
@@ -776,19 +1974,6 @@ with tab2:
             st.error("Please upload a master file and select the columns you wish to export.")
             st.stop()
 
-        # --- DEFINE VALID DISTRICTS (Normalized to Uppercase for Case-Insensitive Match) ---
-        VALID_DISTRICTS_UPPER = [
-            "ARIYALUR", "CHENGALPATU", "CHENGALPATTU", "CHENNAI", "CHENNAI (EXT. GCC)", "COIMBATORE",
-            "CUDDALORE", "DHARMAPURI", "DINDIGUL", "ERODE", "KALLAKURICHI",
-            "KANCHEEPURAM", "KANNIYAKUMARI", "KARUR", "KRISHNAGIRI", "MADURAI",
-            "MAYILADUTHURAI", "NAGAPATTINAM", "NAMAKKAL", "PERAMBALUR", "PUDUKKOTTAI",
-            "RAMANATHAPURAM", "RANIPET", "SALEM", "SIVAGANGAI", "TENKASI",
-            "THANJAVUR", "THE NILGIRIS", "THENI", "THOOTHUKKUDI", "TIRUCHIRAPPALLI",
-            "TIRUNELVELI", "TIRUPATHUR", "TIRUPPUR", "TIRUVALLUR", "TIRUVANNAMALAI",
-            "TIRUVARUR", "VELLORE", "VILLUPURAM", "VIRUDHUNAGAR"
-        ]
-        # ---------------------------------------------------------------------------------
-        
         # Use the pre-loaded DataFrame copy for processing
         df_master = df_master_loaded_temp.copy()
         
@@ -802,9 +1987,9 @@ with tab2:
             st.stop()
 
 
-        # Standardize data: Fill NaNs and ensure string type for matching
-        df_master['District'] = df_master['District'].fillna('').astype(str).str.strip()
-        df['District'] = df['District'].fillna('').astype(str).str.strip()
+        # Standardize data: canonical District categories (computed on distinct spellings, once per upload)
+        canonical_district = canonical_dimensions(tab2_snapshot, df_master_loaded_temp)["District"]
+        df['District'] = canonical_district  # grouping frame only; MASTER_Original keeps the uploaded spellings
 
         # Apply UDISE filtering first
         if udise_input.strip():
@@ -819,122 +2004,216 @@ with tab2:
             st.warning("No matching UDISE codes found.")
             st.stop()
             
-        # --- STRICT CASE-INSENSITIVE FILTERING LOGIC ---
-        
-        # Create a temporary uppercase column for filtering
-        df['District_Upper'] = df['District'].str.upper().str.strip()
-        
-        # Filter the DataFrame to include only rows where the District matches an item 
-        # in the VALID_DISTRICTS_UPPER list (case-insensitively)
-        df_filtered = df[df['District_Upper'].isin(VALID_DISTRICTS_UPPER)].copy()
+        # --- STRICT FILTERING ON CANONICAL DISTRICTS ---
+        # Case / spacing / known variant spellings were folded by canonicalize(); anything else is not approved
+        known = df['District'].isin(CANONICAL_DISTRICTS)
 
-        # Identify and report ignored districts for user feedback
-        all_unique_in_input = df['District_Upper'].unique().tolist()
-        ignored_districts_upper = [d for d in all_unique_in_input if d not in VALID_DISTRICTS_UPPER and d]
-        
-        if ignored_districts_upper:
+        # Identify and report ignored districts for user feedback (distinct values only)
+        ignored_districts = [d for d in df.loc[~known, 'District'].dropna().unique() if d]
+
+        if ignored_districts:
             st.warning(
-                f"🚫 **Ignored:** Found {len(ignored_districts_upper)} unique non-district values (e.g., {', '.join(ignored_districts_upper[:5])}...) "
+                f"🚫 **Ignored:** Found {len(ignored_districts)} unique non-district values (e.g., {', '.join(ignored_districts[:5])}...) "
                 "which are not in the approved list and were removed."
             )
 
-        # Use the filtered DataFrame and drop the temporary column
-        df = df_filtered.drop(columns=['District_Upper'])
-        
+        df = df[known].copy()
+        df['District'] = df['District'].cat.remove_unused_categories()
+
         if df.empty:
             st.warning("After filtering for valid district names, no records remain for processing.")
             st.stop()
             
         # -----------------------------------------------
 
-        # --- Data Type Cleanup (Re-Enabling controlled numeric conversion for output) ---
-        # Now that columns are filtered, we re-enable numeric conversion for ALL non-ID columns
-        # This correctly sets the type for OpenPyXL, while preserving all selected text data.
-        ID_COLUMNS = ['UDISE', 'District'] 
-        
-        for col in df.columns:
-            if col not in ID_COLUMNS:
-                # Attempt to convert column to numeric. If it fails (because it's text), 
-                # it coerces to a numeric type that Pandas can handle (like object/string),
-                # but the conversion only happens if the column is fully numeric.
-                # We use `errors='ignore'` instead of 'coerce' to keep text columns as they are.
-                df[col] = pd.to_numeric(df[col], errors='ignore')
-        # --------------------------------------------------------------------
-
         # ------------------------
-        # OPTION A: All districts in one single Excel file
+        # Build the output as a background job (see sidebar ⬇ Downloads)
         # ------------------------
+        n_districts = df["District"].nunique()
         if output_mode.startswith("Single Excel"):
+            job_id = submit_export_job(
+                f"Master + {n_districts} district sheets", "district_tabs_with_master.xlsx", XLSX_MIME,
+                build_district_workbook, df_master, df, work_factor=EXCEL_WORK_FACTOR
+            )
+        elif output_mode.startswith("ZIP"):
+            job_id = submit_export_job(
+                f"ZIP of {n_districts} district files ({district_file_format})", "district_files.zip",
+                "application/zip", build_district_zip, df, district_file_format,
+                work_factor=EXCEL_WORK_FACTOR if district_file_format.startswith("Excel") else 1.0
+            )
+        else:
+            job_id = submit_export_job(
+                f"Parquet dataset, {n_districts} district partitions", "district_dataset.zip", "application/zip",
+                build_district_parquet_dataset, df
+            )
 
-            # We must use openpyxl directly for multiple sheets/tabs
-            wb = Workbook()
-            wb.remove(wb.active) # Remove the default empty sheet
-
-            # ---- MASTER SHEET (full upload) ----
-            # Create a sheet with the original master data (now filtered by selected columns)
-            ws_master = wb.create_sheet(title="MASTER_Original")
-            for r in dataframe_to_rows(df_master, index=False, header=True):
-                ws_master.append(r)
-
-            # ---- DISTRICT SHEETS (based on df) ----
-            # Grouping by the original 'District' column
-            for district, group in df.groupby("District"):
-                # Clean sheet name for excel constraints (max 31 chars, no invalid chars)
-                sheet_name = str(district)[:31].replace("/", "_").replace("*", "_") 
-                ws = wb.create_sheet(title=sheet_name)
-
-                # openpyxl uses the updated numeric data types from the Pandas group
-                for r in dataframe_to_rows(group, index=False, header=True):
-                    ws.append(r)
-
-            # Write output to buffer
-            output = BytesIO()
-            wb.save(output)
-            output.seek(0)
+        if job_id:
+            st.success(f"Export job `{job_id}` queued for {n_districts} valid districts. Track it under ⬇ Downloads in the sidebar.")
+        else:
+            st.warning(f"You already have {MAX_ACTIVE_JOBS_PER_USER} exports running. Wait for one to finish or cancel it.")
+
+with tab3:
+    st.header("📈 Year-over-Year Comparison")
+    st.caption("Align two master files by UDISE and compare Class totals and enrollment bands per school and per district.")
+
+    def master_source_picker(label: str, key: str, loaded_df=None):
+        """Pick a master source (loaded / configured URL / server file / upload); returns a loader callable or None."""
+        options = ["Online URL", "Server file", "Upload"]
+        if loaded_df is not None:
+            options.insert(0, "Master loaded in UDISE Data Generator")
+        choice = st.radio(f"{label} master source", options, key=f"{key}_src", horizontal=True)
+
+        if choice.startswith("Master loaded"):
+            return lambda: loaded_df
+        if choice == "Online URL":
+            url = st.selectbox(f"{label} master URL", MASTER_SOURCES, key=f"{key}_url")
+            if url:
+                def load_url():
+                    response = requests.get(url, timeout=30)
+                    response.raise_for_status()
+                    return read_master(BytesIO(response.content), url)
+                return load_url
+        elif choice == "Server file":
+            files = server_master_files()
+            if not files:
+                st.caption("No master files are available on the server.")
+            path = st.selectbox(f"{label} master file", files, key=f"{key}_path")
+            if path:
+                return lambda: read_master(path, path)
+        else:
+            upload = st.file_uploader(f"Upload {label.lower()} master", type=["xlsx", "xls", "csv"], key=f"{key}_upload")
+            if upload is not None:
+                return lambda: read_master(upload, upload.name)
+        return None
 
-            st.download_button(
-                "⬇ Download Excel (Master + All Districts)",
-                output,
-                "district_tabs_with_master.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-            st.success(f"Single Excel file generated successfully with {len(df.groupby('District'))} valid district sheets!")
+    def find_first_col(frame: pd.DataFrame, candidates):
+        for c in candidates:
+            if c in frame.columns:
+                return c
+        return None
 
+    col_prev, col_curr = st.columns(2)
+    with col_prev:
+        load_prev = master_source_picker("Previous", "yoy_prev")
+    with col_curr:
+        load_curr = master_source_picker("Current", "yoy_curr", loaded_df=df_master)
 
-        # ------------------------
-        # OPTION B: ZIP file containing one Excel per district
-        # ------------------------
+    if st.button("Compare Masters", key="yoy_compare"):
+        if load_prev is None or load_curr is None:
+            st.error("Please choose both a previous and a current master source.")
         else:
+            try:
+                frames = []
+                for label, loader in (("Previous", load_prev), ("Current", load_curr)):
+                    master = loader()
+                    master.columns = master.columns.str.strip()
+                    u_col = find_first_col(master, udise_candidates)
+                    if not u_col:
+                        raise ValueError(f"{label} master has no UDISE column (expected one of {udise_candidates}).")
+                    frame, dupes = comparison_frame(master, u_col, find_first_col(master, filter_cols_candidates["District"]))
+                    if dupes:
+                        st.warning(f"⚠ {label} master: {dupes} duplicate UDISE rows ignored (first occurrence kept).")
+                    frames.append(frame)
+
+                keep_result("yoy_results", compare_masters(frames[0], frames[1]))
+            except Exception as e:
+                st.error(f"Error comparing masters: {e}")
 
-            zip_buffer = BytesIO()
+    yoy_results = get_result("yoy_results")
+    if yoy_results is not None:
+        yoy_schools, yoy_districts = yoy_results
+        status_counts = yoy_schools["Status"].value_counts()
 
-            with ZipFile(zip_buffer, 'w') as zf:
-                for district, group in df.groupby("District"):
+        m1, m2, m3 = st.columns(3)
+        m1.metric("Schools in both", int(status_counts.get("Both", 0)))
+        m2.metric("Only in current", int(status_counts.get("Only Current", 0)))
+        m3.metric("Only in previous", int(status_counts.get("Only Previous", 0)))
 
-                    # Clean file name
-                    safe_name = str(district)[:31].replace("/", "_").replace("*", "_")
-                    
-                    wb = Workbook()
-                    ws = wb.active
-                    ws.title = safe_name
+        st.subheader("Per-district deltas")
+        result_viewer(yoy_districts, "yoy_districts", copy_label="📋 Copy District Deltas")
+        offer_downloads(yoy_districts, "YoY_District_Deltas", "District Deltas", key="yoy_district_dl")
 
-                    for r in dataframe_to_rows(group, index=False, header=True):
-                        ws.append(r)
+        st.subheader("Per-school deltas")
+        result_viewer(yoy_schools, "yoy_schools", copy_label="📋 Copy School Deltas")
+        offer_downloads(yoy_schools, "YoY_School_Deltas", "School Deltas", key="yoy_school_dl")
 
-                    # Write individual Excel file to buffer
-                    excel_bytes = BytesIO()
-                    wb.save(excel_bytes)
-                    excel_bytes.seek(0)
+        st.markdown("---")
+        st.subheader("📊 Pivot the comparison")
+        pivot_ui(yoy_schools, key_prefix="yoy_", file_base="YoY_Pivot")
 
-                    # Add buffer to zip file
-                    zf.writestr(f"{safe_name}.xlsx", excel_bytes.read())
+with tab4:
+    st.header("📊 District & Block Dashboard")
+    st.caption(f"Standard summaries precomputed for master snapshot `{snapshot_id}` — served without scanning rows.")
+
+    # Standard District / Block summaries: built once per snapshot (stored under DATA_DIR), then only read
+    try:
+        summaries = summary_views(snapshot_id, df_master)
+    except Exception as e:
+        summaries = {}
+        st.warning(f"⚠ Could not build summary views: {e}")
 
-            zip_buffer.seek(0)
+    if not summaries:
+        st.info("No summary views are available for this master (District column not found).")
+    else:
+        district_totals = summaries.get("District: Class totals")
+        district_bands = summaries.get("District: Enrollment bands")
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Schools", f"{int(district_totals['Schools'].sum()):,}")
+        m2.metric("Total enrollment", f"{int(district_bands['Total_Enrollment'].sum()):,}")
+        m3.metric("Districts", len(district_totals))
+        if "District × Block: Class totals" in summaries:
+            m4.metric("Blocks", len(summaries["District × Block: Class totals"]))
+
+        level = st.radio("Level", [l for l in SUMMARY_LEVELS if any(n.startswith(f"{l}:") for n in summaries)],
+                         horizontal=True, key="dash_level")
+        view_names = [n.split(": ", 1)[1] for n in summaries if n.startswith(f"{level}:")]
+        view_name = st.selectbox("Summary", view_names, key="dash_view")
+        view = summaries[f"{level}: {view_name}"]
+
+        dash_districts = st.multiselect("Districts (optional)", options=list(district_totals["District"]),
+                                        key="dash_districts")
+        if dash_districts:
+            view = view[view["District"].isin(dash_districts)]
+
+        st.dataframe(view, hide_index=True)
+        offer_downloads(view, f"Summary_{level}_{view_name}".replace(" ", "_").replace("×", "x"), "Summary",
+                        key="dash_dl")
+
+        def all_summaries_zip() -> bytes:
+            buffer = BytesIO()
+            with ZipFile(buffer, "w") as zf:
+                for name, frame in summaries.items():
+                    safe = name.replace(": ", "__").replace(" ", "_").replace("×", "x")
+                    zf.writestr(f"{safe}.csv", frame.to_csv(index=False))
+            return buffer.getvalue()
+
+        st.download_button("⬇ Download all summaries (ZIP of CSVs)", all_summaries_zip,
+                           file_name=f"udise_summaries_{snapshot_id}.zip", mime="application/zip",
+                           key="dash_all_dl", on_click="ignore")
+
+# -------------------------
+# Export jobs (rendered last so every tab's submissions show up in this run)
+# -------------------------
+with st.sidebar:
+    st.markdown("---")
+    st.header("⬇ Downloads")
+    if any(j["status"] in ("queued", "running") for j in session_export_jobs()):
+        st.fragment(run_every=2)(export_jobs_panel)()
+    else:
+        st.fragment(export_jobs_panel)()
 
-            st.download_button(
-                "⬇ Download ZIP (District Files)",
-                zip_buffer,
-                "district_files.zip",
-                mime="application/zip"
-            )
-            st.success(f"ZIP file created successfully containing {len(df.groupby('District'))} valid district files!")
+    st.markdown("---")
+    with st.expander("🩺 Diagnostics"):
+        st.write(f"Process `{os.getpid()}` · master source: {startup['source'] or '—'}")
+        st.caption(f"Warm start finished {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(startup['ready_at']))} "
+                   f"· health file: `{HEALTH_FILE}`")
+        st.dataframe(pd.DataFrame({"Step": list(startup["timings"]), "Seconds": list(startup["timings"].values())}),
+                     hide_index=True)
+
+        used = memory_usage()
+        if MEMORY_BUDGET:
+            st.progress(min(1.0, used / MEMORY_BUDGET),
+                        text=f"Memory: {used / 2**20:,.0f} MB of {MEMORY_BUDGET / 2**20:,.0f} MB budget")
+        else:
+            st.write(f"Memory: {used / 2**20:,.0f} MB (no budget set)")
+        st.dataframe(memory_report(), hide_index=True)
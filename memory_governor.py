@@ -0,0 +1,140 @@
+"""Process-wide memory budget for masters, per-snapshot caches, session results and export builds.
+
+Imported once per process (Streamlit re-runs main.py but not its imports), so it can be tested on its own."""
+
+import os
+import threading
+import time
+import weakref
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# UDISE_MEMORY_BUDGET_MB: process-wide budget for everything registered below (0 = unlimited)
+MEMORY_BUDGET = int(float(os.environ.get("UDISE_MEMORY_BUDGET_MB", "2048")) * 2**20)
+# Eviction order when over budget: lowest priority first, least recently used first within a priority
+MEMORY_PRIORITY = {"export": 0, "result": 1, "summary": 2, "index": 3, "master": 4}
+
+
+@st.cache_resource
+def get_memory_ledger() -> dict:
+    """Process-wide accounting (key -> {"kind", "bytes", "used", "evict", "owner"}); survives script reruns."""
+    return {"lock": threading.RLock(), "entries": {}}
+
+
+def memory_prune():
+    """Drop entries whose owner has been garbage collected (e.g. the session that held a result ended)."""
+    ledger = get_memory_ledger()
+    with ledger["lock"]:
+        for k, e in list(ledger["entries"].items()):
+            if e["owner"] is not None and e["owner"]() is None:
+                del ledger["entries"][k]
+
+
+def object_bytes(obj) -> int:
+    """Approximate in-memory size of frames, arrays, bytes and dicts / sequences of those."""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=True))
+    if isinstance(obj, np.ndarray):
+        return 0 if isinstance(obj, np.memmap) else obj.nbytes  # memory-mapped views are file-backed
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sum(object_bytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(object_bytes(v) for v in obj)
+    return 0
+
+
+def memory_usage() -> int:
+    ledger = get_memory_ledger()
+    with ledger["lock"]:
+        memory_prune()
+        return sum(e["bytes"] for e in ledger["entries"].values())
+
+
+def memory_register(key: str, kind: str, nbytes: int, evict=None, owner=None):
+    """Account nbytes under key (replacing its previous size), then evict others while over budget.
+
+    evict() drops (or spills) the artifact; entries without it are counted but never evicted.
+    With an owner, the entry is held by weak reference and disappears once the owner is collected."""
+    ledger = get_memory_ledger()
+    with ledger["lock"]:
+        ledger["entries"][key] = {"kind": kind, "bytes": int(nbytes), "used": time.monotonic(), "evict": evict,
+                                  "owner": None if owner is None else weakref.ref(owner)}
+        memory_admit(0, keep=key)
+
+
+def memory_touch(key: str):
+    entry = get_memory_ledger()["entries"].get(key)
+    if entry:
+        entry["used"] = time.monotonic()
+
+
+def memory_release(key: str):
+    ledger = get_memory_ledger()
+    with ledger["lock"]:
+        ledger["entries"].pop(key, None)
+
+
+def memory_admit(nbytes: int, keep: str = None) -> bool:
+    """Evict by priority / LRU until nbytes more fit in MEMORY_BUDGET; returns whether they fit.
+
+    An admission check (nbytes > 0) evicts nothing when even evicting every evictable entry would not
+    make room. With nbytes == 0 (after a registration) it evicts until usage is back under budget or
+    nothing evictable is left, so pinned entries over budget do not stop the caches from being trimmed."""
+    if not MEMORY_BUDGET:
+        return True
+    ledger = get_memory_ledger()
+    with ledger["lock"]:
+        used = memory_usage()
+        if used + nbytes <= MEMORY_BUDGET:
+            return True
+        entries = ledger["entries"]
+        victims = sorted(
+            (MEMORY_PRIORITY.get(e["kind"], 0), e["used"], k)
+            for k, e in entries.items() if e["evict"] is not None and k != keep
+        )
+        if nbytes and used - sum(entries[k]["bytes"] for _, _, k in victims) + nbytes > MEMORY_BUDGET:
+            return False
+        for _, _, k in victims:
+            if used + nbytes <= MEMORY_BUDGET:
+                break
+            entry = entries.pop(k)
+            used -= entry["bytes"]
+            try:
+                entry["evict"]()
+            except Exception:
+                pass
+        return used + nbytes <= MEMORY_BUDGET
+
+
+def memory_report() -> pd.DataFrame:
+    """Current usage per kind (for the Diagnostics panel)."""
+    ledger = get_memory_ledger()
+    with ledger["lock"]:
+        memory_prune()
+        rows = [(e["kind"], e["bytes"]) for e in ledger["entries"].values()]
+    usage = pd.DataFrame(rows, columns=["Kind", "Bytes"]).groupby("Kind").agg(Entries=("Bytes", "size"), Bytes=("Bytes", "sum"))
+    usage["MB"] = (usage.pop("Bytes") / 2**20).round(1)
+    return usage.reset_index()
+
+
+def reserve_export(job_id: str, nbytes: int) -> str:
+    """Admission for an export build of about nbytes.
+
+    "run" when it fits the memory budget, "spill" when it does not but no other build is in flight
+    (it runs alone and streams its file to disk), otherwise "wait"."""
+    ledger = get_memory_ledger()
+    with ledger["lock"]:
+        if memory_admit(nbytes):
+            decision = "run"
+        elif not any(k.startswith("export-build:") for k in ledger["entries"]):
+            decision = "spill"
+        else:
+            return "wait"
+        memory_register(f"export-build:{job_id}", "export", nbytes)  # in flight: counted, never evicted
+        return decision
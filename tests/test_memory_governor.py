@@ -0,0 +1,85 @@
+"""Memory ledger: eviction order, registration over budget and export admission."""
+import unittest
+from unittest import mock
+
+import memory_governor as mg
+
+MB = 2**20
+
+
+class LedgerTestCase(unittest.TestCase):
+    def setUp(self):
+        mg.get_memory_ledger.clear()
+        patcher = mock.patch.object(mg, "MEMORY_BUDGET", 10 * MB)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(mg.get_memory_ledger.clear)
+        self.evicted = []
+
+    def register(self, key, kind, mb, evictable=True):
+        evict = (lambda: self.evicted.append(key)) if evictable else None
+        mg.memory_register(key, kind, mb * MB, evict=evict)
+
+
+class EvictionTest(LedgerTestCase):
+    def test_lowest_priority_then_least_recently_used(self):
+        self.register("index:a", "index", 3)
+        self.register("result:old", "result", 3)
+        self.register("result:new", "result", 3)
+        mg.memory_touch("result:old")
+        self.register("summary:a", "summary", 3)  # 12 MB: one victim is enough
+        self.assertEqual(self.evicted, ["result:new"])
+        self.register("master:a", "master", 4)  # 13 MB: results go before summaries and indexes
+        self.assertEqual(self.evicted, ["result:new", "result:old"])
+        self.assertLessEqual(mg.memory_usage(), mg.MEMORY_BUDGET)
+
+    def test_registered_entry_is_not_its_own_victim(self):
+        self.register("result:a", "result", 4)
+        self.register("result:b", "result", 8)
+        self.assertEqual(self.evicted, ["result:a"])
+        self.assertIn("result:b", mg.get_memory_ledger()["entries"])
+
+
+class OverBudgetRegistrationTest(LedgerTestCase):
+    def test_pinned_master_over_budget_still_trims_caches(self):
+        self.register("master:startup", "master", 12, evictable=False)
+        self.register("index:a", "index", 1)
+        self.register("result:a", "result", 1)
+        self.assertEqual(self.evicted, ["index:a"])
+        self.register("result:b", "result", 1)
+        self.assertEqual(self.evicted, ["index:a", "result:a"])
+        self.assertEqual(set(mg.get_memory_ledger()["entries"]), {"master:startup", "result:b"})
+
+    def test_admission_that_cannot_fit_evicts_nothing(self):
+        self.register("master:startup", "master", 6, evictable=False)
+        self.register("result:a", "result", 2)
+        self.assertFalse(mg.memory_admit(5 * MB))
+        self.assertEqual(self.evicted, [])
+        self.assertTrue(mg.memory_admit(3 * MB))
+        self.assertEqual(self.evicted, ["result:a"])
+
+    def test_unlimited_budget(self):
+        with mock.patch.object(mg, "MEMORY_BUDGET", 0):
+            self.register("result:a", "result", 50)
+            self.assertTrue(mg.memory_admit(100 * MB))
+        self.assertEqual(self.evicted, [])
+
+
+class ExportAdmissionTest(LedgerTestCase):
+    def test_run_spill_wait(self):
+        self.register("master:startup", "master", 6, evictable=False)
+        self.assertEqual(mg.reserve_export("small", 3 * MB), "run")
+        self.assertEqual(mg.reserve_export("large", 20 * MB), "wait")  # another build is in flight
+        mg.memory_release("export-build:small")
+        self.assertEqual(mg.reserve_export("large", 20 * MB), "spill")  # alone: streams to disk
+        self.assertEqual(mg.reserve_export("next", 1 * MB), "wait")
+        self.assertIn("export-build:large", mg.get_memory_ledger()["entries"])
+
+    def test_run_evicts_cached_results(self):
+        self.register("result:a", "result", 8)
+        self.assertEqual(mg.reserve_export("job", 4 * MB), "run")
+        self.assertEqual(self.evicted, ["result:a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+"""Regression: a master with blank UDISE / District cells must still load and be profiled."""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from streamlit.testing.v1 import AppTest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+MASTER_CSV = (
+    "UDISE,School Name,District,Block,Class1_Boys,Class1_Girls,Class1_Transgen\n"
+    "33000000001,School 1,Salem,B1,10,12,0\n"
+    ",School 2,Salem,B1,5,abc,0\n"
+    "33000000003,School 3,,B2,7,8,-1\n"
+)
+
+
+class MissingKeysTest(unittest.TestCase):
+    def test_blank_udise_and_district(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "master.csv"), "w") as fh:
+                fh.write(MASTER_CSV)
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            # unreachable proxy: the default online master fails fast and the local master.csv is used
+            env = {"UDISE_DATA_DIR": os.path.join(tmp, "data"), "HTTPS_PROXY": "http://127.0.0.1:9",
+                   "HTTP_PROXY": "http://127.0.0.1:9"}
+            try:
+                with mock.patch.dict(os.environ, env):
+                    at = AppTest.from_file(APP, default_timeout=60).run()
+            finally:
+                os.chdir(cwd)
+
+        self.assertEqual([e.message for e in at.exception], [])
+        self.assertEqual([e.value for e in at.error], [])
+        labels = [e.label for e in at.expander]
+        self.assertTrue(any("Data quality" in label for label in labels), labels)
+        checks = at.dataframe[0].value["Check"].tolist()
+        for check in ("Missing UDISE", "Missing district", "Non-numeric count (read as 0)", "Negative count"):
+            self.assertIn(check, checks)
+
+
+if __name__ == "__main__":
+    unittest.main()
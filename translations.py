@@ -0,0 +1,60 @@
+"""UI strings per language (imported once per process; Streamlit re-runs main.py but not its imports)."""
+
+TRANSLATIONS = {
+    "en": {
+        "title": "UDISE Data Generator",
+        "upload": "Upload School Master List (Excel or CSV)",
+        "preview": "Preview Uploaded Data",
+        "udise_col": "Select UDISE Column",
+        "udise_input": "Enter one or more UDISE Codes (comma or newline separated)",
+        "select_columns": "Select Columns to Include in Output",
+        "generate": "Generate Output",
+        "filters": "Filters",
+        "create_calc": "Create Custom Fields (Optional)",
+        "calc_type": "Choose Calculation Type",
+        "sum": "Sum",
+        "diff": "Difference (A - B)",
+        "avg": "Average",
+        "custom": "Custom Formula (simple)",
+        "new_field": "Enter new field name (no spaces recommended)",
+        "add_field": "Add Calculated Field",
+        "preset_formulas": "Preset Formulas",
+        "download": "⬇ Download Excel Output",
+        "no_file": "Please upload a master list file to proceed.",
+        "no_udise": "Please enter at least one UDISE Code.",
+        "no_matches": "⚠ No matching UDISE codes found.",
+        "found_matches": "✔ Found {n} matching records",
+        "apply_filters": "Apply Filters",
+        "save_preset": "Save current computed fields as preset",
+        "preset_saved": "Preset saved.",
+        "preset_applied": "Applied preset {k}"
+    },
+    "ta": {
+        "title": "UDISE தரவு உருவாக்கி",
+        "upload": "பள்ளி மாஸ்டர் பட்டியலை (Excel அல்லது CSV) பதிவேற்றுங்கள்",
+        "preview": "பதிவேற்றப்பட்ட தரவின் முன்னோட்டம்",
+        "udise_col": "UDISE பத்து தேர்ந்தெடுக்கவும்",
+        "udise_input": "ஒரு அல்லது அதற்கு மேற்பட்ட UDISE குறியீடுகளை உள்ளிடுங்கள் (கமா அல்லது புதிய வரியில்)",
+        "select_columns": "ஏற்றுமதிக்கக் காணிக்கைகள் தேர்வு செய்க",
+        "generate": "வெளியீட்டை உருவாக்கு",
+        "filters": "வடிகட்டல்கள்",
+        "create_calc": "செயல்படுத்தப்பட்ட களங்களை உருவாக்கு (இருப்பினால்)",
+        "calc_type": "கணக்கீட்டு வகையை தேர்ந்தெடுக்கவும்",
+        "sum": "கூட்டல்",
+        "diff": "வித்தியாசம் (A - B)",
+        "avg": "சராசா",
+        "custom": "தனிப்பயன் சூத்திரம் (எளிது)",
+        "new_field": "புதிய களப் பெயரை உள்ளிடவும் (வெற்று இடங்கள் தவிர்க்கவும்)",
+        "add_field": "கணக்கீட்டுப் புலம் சேர்க்கவும்",
+        "preset_formulas": "முன்னிருப்பு சூத்திரங்கள்",
+        "download": "⬇ Excel பதிவிறக்கம்",
+        "no_file": "தொடர உங்கள் மாஸ்டர் பட்டியலை பதிவேற்றவும்.",
+        "no_udise": "அனைத்து குறைந்தது ஒரு UDISE குறியீட்டை உள்ளிடவும்.",
+        "no_matches": "⚠ பொருந்தக்கூடிய UDISE குறியீடுகள் இல்லை.",
+        "found_matches": "✔ {n} பொருந்தக்கூடிய பதிவுகள் காணப்பட்டன",
+        "apply_filters": "வடிகட்டல்கள் சமர்ப்பி",
+        "save_preset": "தற்போதைய கணக்கீட்டுச் புலங்களை மூலமாக சேமிக்கவும்",
+        "preset_saved": "முன்னிருப்பு சேமிக்கப்பட்டது.",
+        "preset_applied": "முன்னிருப்பு {k} பொருந்தியது"
+    }
+}